@@ -0,0 +1,292 @@
+import botocore.exceptions
+import email.utils
+import hashlib
+import io
+import os
+import re
+import requests
+import requests.adapters
+import requests.structures
+import shutil
+import threading
+import urllib3.response
+
+class Body:
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size = -1):
+        return self.stream.read(size)
+
+class Paginator:
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix = '', Delimiter = None, **kwargs):
+        items = self.s3.objects(Bucket, Prefix)
+        common = []
+        if Delimiter is not None:
+            contents = []
+            for item in items:
+                rest = item['Key'][len(Prefix):]
+                if Delimiter in rest:
+                    folder = Prefix+rest.split(Delimiter, 1)[0]+Delimiter
+                    if folder not in common:
+                        common.append(folder)
+                else:
+                    contents.append(item)
+            items = contents
+        entries = [('Contents', item) for item in items] + [('CommonPrefixes', {'Prefix': folder}) for folder in common]
+        for start in range(0, max(len(entries), 1), 1000):
+            self.s3.requests += 1
+            page = {'KeyCount': len(entries[start:start + 1000])}
+            for kind, entry in entries[start:start + 1000]:
+                page.setdefault(kind, []).append(entry)
+            yield page
+
+class Waiter:
+
+    def wait(self, **kwargs):
+        return None
+
+class S3:
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.etags = {}
+        self.requests = 0
+
+    def path(self, bucket, key, create = False):
+        path = os.path.join(self.root, bucket, key)
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        return path
+
+    def missing(self, bucket, key, operation):
+        if not os.path.isfile(self.path(bucket, key)):
+            raise botocore.exceptions.ClientError({'Error': {'Code': '404' if operation == 'HeadObject' else 'NoSuchKey'}}, operation)
+
+    def etag(self, path):
+        stat = os.stat(path)
+        marker = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.etags.get(path)
+        if cached is not None and cached[0] == marker:
+            return cached[1]
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        value = '"'+digest.hexdigest()+'"'
+        with self.lock:
+            self.etags[path] = (marker, value)
+        return value
+
+    def objects(self, bucket, prefix = ''):
+        base = os.path.join(self.root, bucket)
+        items = []
+        for folder, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(folder, name)
+                key = os.path.relpath(path, base).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    items.append({'Key': key, 'Size': os.path.getsize(path), 'ETag': self.etag(path)})
+        return sorted(items, key = lambda item: item['Key'])
+
+    def list_objects(self, Bucket, Prefix = '', **kwargs):
+        self.requests += 1
+        items = self.objects(Bucket, Prefix)[:1000]
+        return {'Contents': items} if len(items) > 0 else {}
+
+    def list_objects_v2(self, Bucket, Prefix = '', **kwargs):
+        self.requests += 1
+        items = self.objects(Bucket, Prefix)[:1000]
+        return {'Contents': items, 'KeyCount': len(items)} if len(items) > 0 else {'KeyCount': 0}
+
+    def get_paginator(self, name):
+        return Paginator(self)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.requests += 1
+        self.missing(Bucket, Key, 'HeadObject')
+        path = self.path(Bucket, Key)
+        return {'ETag': self.etag(path), 'ContentLength': os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key, Range = None, **kwargs):
+        self.requests += 1
+        self.missing(Bucket, Key, 'GetObject')
+        path = self.path(Bucket, Key)
+        with open(path, 'rb') as f:
+            if Range is None:
+                data = f.read()
+            else:
+                first, last = Range[len('bytes='):].split('-')
+                if first == '':
+                    f.seek(max(0, os.path.getsize(path) - int(last)))
+                    data = f.read()
+                else:
+                    f.seek(int(first))
+                    data = f.read(int(last) - int(first) + 1 if last != '' else -1)
+        return {'Body': Body(data), 'ContentLength': len(data), 'ETag': self.etag(path)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.requests += 1
+        with open(self.path(Bucket, Key, True), 'wb') as f:
+            f.write(Body if isinstance(Body, (bytes, bytearray)) else Body.read())
+        return {'ETag': self.etag(self.path(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.requests += 1
+        if os.path.isfile(self.path(Bucket, Key)):
+            os.remove(self.path(Bucket, Key))
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs = None, **kwargs):
+        self.requests += 1
+        shutil.copyfile(Filename, self.path(Bucket, Key, True))
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        self.requests += 1
+        self.missing(Bucket, Key, 'HeadObject')
+        shutil.copyfile(self.path(Bucket, Key), Filename)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        self.requests += 1
+        self.missing(Bucket, Key, 'HeadObject')
+        with open(self.path(Bucket, Key), 'rb') as f:
+            shutil.copyfileobj(f, Fileobj, 1024 * 1024)
+
+class SSM:
+
+    def __init__(self, values):
+        self.values = dict(values)
+
+    def get_parameter(self, Name, **kwargs):
+        return {'Parameter': {'Name': Name, 'Value': self.values[Name]}}
+
+    def get_parameters(self, Names, **kwargs):
+        return {
+            'Parameters': [{'Name': name, 'Value': self.values[name]} for name in Names if name in self.values],
+            'InvalidParameters': [name for name in Names if name not in self.values]
+        }
+
+    def put_parameter(self, Name, Value, **kwargs):
+        self.values[Name] = Value
+        return {'Version': 1}
+
+class Lambda:
+
+    def __init__(self):
+        self.layers = []
+        self.versions = 0
+        self.published = []
+        self.sha256 = 'initial'
+        self.calls = []
+
+    def get_waiter(self, name):
+        return Waiter()
+
+    def get_function_configuration(self, FunctionName, **kwargs):
+        return {'CodeSha256': self.sha256, 'Layers': [{'Arn': arn} for arn in self.layers]}
+
+    def publish_layer_version(self, LayerName, **kwargs):
+        self.calls.append('publish_layer_version')
+        self.versions += 1
+        self.published.append(self.versions)
+        arn = 'arn:aws:lambda:us-east-1:123456789012:layer:'+LayerName
+        return {'LayerArn': arn, 'LayerVersionArn': arn+':'+str(self.versions), 'Version': self.versions}
+
+    def list_layer_versions(self, LayerName, **kwargs):
+        return {'LayerVersions': [{'Version': version} for version in sorted(self.published, reverse = True)]}
+
+    def delete_layer_version(self, LayerName, VersionNumber, **kwargs):
+        self.calls.append('delete_layer_version')
+        self.published.remove(VersionNumber)
+
+    def update_function_configuration(self, FunctionName, Layers = None, **kwargs):
+        self.calls.append('update_function_configuration')
+        if Layers is not None:
+            self.layers = list(Layers)
+        return {'CodeSha256': self.sha256}
+
+    def update_function_code(self, FunctionName, **kwargs):
+        self.calls.append('update_function_code')
+        self.sha256 = hashlib.sha256(str(len(self.calls)).encode('utf-8')).hexdigest()
+        return {'CodeSha256': self.sha256}
+
+class MaxMind(requests.adapters.BaseAdapter):
+
+    PATTERN = re.compile(r'/geoip/databases/GeoLite2-(\w+)/download\?suffix=([\w.]+)$')
+
+    def __init__(self, directory, modified):
+        super().__init__()
+        self.directory = directory
+        self.modified = modified
+        self.requests = 0
+
+    def respond(self, request, status, headers, body):
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.status_code = status
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.raw = urllib3.response.HTTPResponse(body = body, headers = headers, status = status, preload_content = False, decode_content = False)
+        return response
+
+    def send(self, request, stream = False, timeout = None, verify = True, cert = None, proxies = None):
+        self.requests += 1
+        match = self.PATTERN.search(request.url)
+
+        if match is None or not os.path.isfile(os.path.join(self.directory, 'GeoLite2-'+match.group(1)+'.tar.gz')):
+            return self.respond(request, 404, {}, io.BytesIO(b''))
+
+        path = os.path.join(self.directory, 'GeoLite2-'+match.group(1)+'.tar.gz')
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = '"'+hashlib.md5(data).hexdigest()+'"'
+
+        if match.group(2) == 'tar.gz.sha256':
+            body = (hashlib.sha256(data).hexdigest()+'  GeoLite2-'+match.group(1)+'.tar.gz\n').encode('utf-8')
+            return self.respond(request, 200, {'Content-Length': str(len(body))}, io.BytesIO(body))
+
+        unchanged = request.headers.get('If-None-Match') == etag
+        if request.headers.get('If-Modified-Since') is not None and request.headers.get('If-None-Match') is None:
+            unchanged = email.utils.parsedate_to_datetime(request.headers['If-Modified-Since']) >= email.utils.parsedate_to_datetime(self.modified)
+
+        if unchanged:
+            return self.respond(request, 304, {'Last-Modified': self.modified, 'ETag': etag}, io.BytesIO(b''))
+
+        headers = {
+            'Last-Modified': self.modified,
+            'ETag': etag,
+            'Accept-Ranges': 'bytes'
+        }
+
+        ranged = request.headers.get('Range')
+        if ranged is not None and request.headers.get('If-Range') in (None, etag, self.modified):
+            first, last = ranged[len('bytes='):].split('-')
+            first = int(first)
+            last = min(int(last) if last != '' else len(data) - 1, len(data) - 1)
+            headers['Content-Range'] = 'bytes '+str(first)+'-'+str(last)+'/'+str(len(data))
+            headers['Content-Length'] = str(last - first + 1)
+            return self.respond(request, 206, headers, io.BytesIO(data[first:last + 1]))
+
+        headers['Content-Length'] = str(len(data))
+        return self.respond(request, 200, headers, io.BytesIO(data))
+
+    def close(self):
+        pass
+
+def install(s3, ssm, client):
+
+    import boto3
+
+    services = {
+        's3': s3,
+        'ssm': ssm,
+        'lambda': client
+    }
+
+    boto3.client = lambda service, *args, **kwargs: services[service]
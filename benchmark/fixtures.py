@@ -0,0 +1,192 @@
+import ipaddress
+import json
+import netaddr
+import os
+import random
+import tarfile
+
+from mmdb_writer import MMDBWriter
+
+PRESETS = {
+    'small': {
+        'City': (50000, 10000),
+        'ASN': (20000, 5000)
+    },
+    'realistic': {
+        'City': (1000000, 250000),
+        'ASN': (400000, 100000)
+    }
+}
+
+POOLS = {
+    'City': 20000,
+    'ASN': 50000
+}
+
+LANGUAGES = ['de', 'en', 'es', 'fr', 'ja', 'pt-BR', 'ru', 'zh-CN']
+
+COUNTRIES = [
+    ('US', 'United States', 6252001),
+    ('DE', 'Germany', 2921044),
+    ('BR', 'Brazil', 3469034),
+    ('JP', 'Japan', 1861060),
+    ('IN', 'India', 1269750),
+    ('GB', 'United Kingdom', 2635167),
+    ('FR', 'France', 3017382),
+    ('AU', 'Australia', 2077456)
+]
+
+PREFIXES = {
+    4: [18, 20, 21, 22, 23, 24, 24, 24, 24, 24, 25, 26, 27, 28, 29],
+    6: [29, 32, 36, 40, 44, 48, 48, 48, 56, 64]
+}
+
+RELEASE = '20250101'
+
+MODIFIED = 'Wed, 01 Jan 2025 00:00:00 GMT'
+
+ADDRESSES = 20000
+
+def names(value):
+
+    return {language: value for language in LANGUAGES}
+
+def city(rng, i):
+
+    code, country, geoname = COUNTRIES[i % len(COUNTRIES)]
+
+    record = {
+        'continent': {'code': 'NA', 'geoname_id': 6255149, 'names': names('Continent '+str(i % 7))},
+        'country': {'geoname_id': geoname, 'iso_code': code, 'names': names(country)},
+        'registered_country': {'geoname_id': geoname, 'iso_code': code, 'names': names(country)},
+        'location': {
+            'accuracy_radius': rng.choice([5, 10, 20, 50, 100, 200, 500, 1000]),
+            'latitude': round(rng.uniform(-60, 70), 4),
+            'longitude': round(rng.uniform(-180, 180), 4),
+            'time_zone': 'Etc/GMT+'+str(i % 12)
+        }
+    }
+
+    if i % 10 != 0:
+        record['city'] = {'geoname_id': 1000000 + i, 'names': names('City '+str(i))}
+        record['postal'] = {'code': format(rng.randrange(100000), '05d')}
+        record['subdivisions'] = [{'geoname_id': 2000000 + i % 50, 'iso_code': 'S'+str(i % 50), 'names': names('State '+str(i % 50))}]
+
+    return record
+
+def asn(rng, i):
+
+    return {
+        'autonomous_system_number': 1000 + i,
+        'autonomous_system_organization': 'Synthetic Network Operator '+str(i)
+    }
+
+RECORDS = {
+    'City': city,
+    'ASN': asn
+}
+
+def networks(rng, version, count):
+
+    if version == 4:
+        width = 32
+        position = 1 << 24
+        limit = 224 << 24
+    else:
+        width = 128
+        position = 0x2001 << 112
+        limit = 0x3000 << 112
+
+    for _ in range(count):
+        prefixlen = rng.choice(PREFIXES[version])
+        size = 1 << (width - prefixlen)
+        position = (position + size - 1) // size * size
+        if position + size > limit:
+            return
+        yield position, prefixlen
+        position += size * (1 + rng.randrange(2))
+
+def database(path, edition, counts, seed):
+
+    rng = random.Random(seed)
+    pool = [RECORDS[edition](rng, i) for i in range(POOLS[edition])]
+
+    writer = MMDBWriter(
+        ip_version = 6,
+        database_type = 'GeoLite2-'+edition,
+        languages = LANGUAGES,
+        description = {language: 'Synthetic GeoLite2 '+edition+' benchmark fixture' for language in LANGUAGES},
+        ipv4_compatible = True
+    )
+
+    inserted = []
+    for version, count in zip((4, 6), counts):
+        for start, prefixlen in networks(rng, version, count):
+            network = netaddr.IPNetwork((start, prefixlen), version = version)
+            writer.insert_network(netaddr.IPSet([network]), pool[rng.randrange(len(pool))])
+            inserted.append((version, start, prefixlen))
+
+    writer.to_db_file(path)
+
+    return inserted
+
+def archive(directory, edition):
+
+    folder = 'GeoLite2-'+edition+'_'+RELEASE
+
+    with tarfile.open(os.path.join(directory, 'GeoLite2-'+edition+'.tar.gz'), 'w:gz') as tar:
+        tar.add(os.path.join(directory, 'GeoLite2-'+edition+'.mmdb'), folder+'/GeoLite2-'+edition+'.mmdb')
+        for name in ('COPYRIGHT.txt', 'LICENSE.txt'):
+            tar.add(os.path.join(directory, name), folder+'/'+name)
+
+def addresses(rng, inserted, count):
+
+    results = []
+
+    for _ in range(count):
+        if rng.random() < 0.7:
+            version, start, prefixlen = inserted[rng.randrange(len(inserted))]
+            width = 32 if version == 4 else 128
+            results.append(str(ipaddress.ip_address(start + rng.randrange(1 << (width - prefixlen)))))
+        elif rng.random() < 0.8:
+            results.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+        else:
+            results.append(str(ipaddress.IPv6Address((0x2000 << 112) | rng.getrandbits(125))))
+
+    return results
+
+def generate(directory, preset = 'small', seed = 1):
+
+    params = json.loads(json.dumps({'preset': preset, 'seed': seed, 'release': RELEASE, 'counts': PRESETS[preset]}))
+    manifest = os.path.join(directory, 'manifest.json')
+
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as f:
+            if json.load(f) == params:
+                return directory
+
+    os.makedirs(directory, exist_ok = True)
+
+    for name in ('COPYRIGHT.txt', 'LICENSE.txt'):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write('Synthetic data for benchmarking only.\n')
+
+    inserted = []
+    for offset, edition in enumerate(('City', 'ASN')):
+        print('Generating GeoLite2-'+edition+'.mmdb')
+        inserted.extend(database(os.path.join(directory, 'GeoLite2-'+edition+'.mmdb'), edition, PRESETS[preset][edition], seed + offset))
+        archive(directory, edition)
+        with open(os.path.join(directory, edition.lower()+'.updated'), 'w') as f:
+            f.write(MODIFIED)
+
+    with open(os.path.join(directory, 'addresses.json'), 'w') as f:
+        json.dump(addresses(random.Random(seed), inserted, ADDRESSES), f)
+
+    with open(manifest, 'w') as f:
+        json.dump(params, f)
+
+    return directory
+
+if __name__ == '__main__':
+    import sys
+    generate(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'small')
@@ -0,0 +1,90 @@
+import argparse
+import ipaddress
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import run
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default = os.environ.get('MMDB_PATH', '/opt'))
+    parser.add_argument('--count', type = int, default = 20000)
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args(argv)
+
+    os.environ['MMDB_PATH'] = args.path
+    os.environ['CACHE_SIZE'] = '0'
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code'))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'download'))
+
+    import intervals
+    import search
+
+    if not os.path.exists(search.INDEXES['geolite2']):
+        print('Missing '+search.INDEXES['geolite2'])
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix = 'geolite2-merged-')
+
+    try:
+        for name in ('city', 'asn'):
+            if not os.path.exists(search.DATABASES[name][0]):
+                print('Missing '+search.DATABASES[name][0])
+                return 1
+            search.INDEXES[name] = os.path.join(workdir, name+'.idx')
+            intervals.build(search.DATABASES[name][0], name, search.INDEXES[name])
+        return measure(search, args.count, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+def measure(search, count, seed):
+
+    rng = random.Random(seed)
+    ipaddrs = []
+    for _ in range(count):
+        if rng.random() < 0.8:
+            ipaddrs.append(ipaddress.IPv4Address(rng.getrandbits(32)))
+        else:
+            ipaddrs.append(ipaddress.IPv6Address((0x2000 << 112) | rng.getrandbits(125)))
+
+    for ipaddr in ipaddrs[:100]:
+        search.geo(ipaddr)
+        search.asn(ipaddr)
+        search.INTERVALS.locate('city', [ipaddr])
+        search.INTERVALS.locate('asn', [ipaddr])
+        search.INTERVALS.locate('geolite2', [ipaddr])
+
+    results = {
+        'count': len(ipaddrs),
+        'two_readers': run.timings(lambda ipaddr: (search.geo(ipaddr), search.asn(ipaddr)), ipaddrs),
+        'two_indexes': run.timings(lambda ipaddr: (search.INTERVALS.locate('city', [ipaddr]), search.INTERVALS.locate('asn', [ipaddr])), ipaddrs),
+        'merged': run.timings(lambda ipaddr: search.INTERVALS.locate('geolite2', [ipaddr], ['city', 'asn']), ipaddrs)
+    }
+
+    start = time.perf_counter()
+    for ipaddr in ipaddrs:
+        search.geo(ipaddr)
+        search.asn(ipaddr)
+    results['two_readers']['per_second'] = round(len(ipaddrs) / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    search.INTERVALS.locate('city', ipaddrs)
+    search.INTERVALS.locate('asn', ipaddrs)
+    results['two_indexes']['per_second'] = round(len(ipaddrs) / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    search.INTERVALS.locate('geolite2', ipaddrs, ['city', 'asn'])
+    results['merged']['per_second'] = round(len(ipaddrs) / (time.perf_counter() - start))
+
+    print(json.dumps(results, indent = 4))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import ipaddress
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import fakes
+import fixtures
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ARCHIVE = 'maxmindgeolite2archive'
+
+BUCKET = 'geolite2-benchmark'
+
+RESEARCH = 'geolite2-research'
+
+COLD = '''
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import search
+imported = time.perf_counter()
+search.handler({'rawQueryString': sys.argv[2]}, None)
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_ms': (time.perf_counter() - imported) * 1000}))
+'''
+
+def percentile(samples, value):
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * value))]
+
+def summary(samples):
+
+    return {
+        'count': len(samples),
+        'p50_us': round(percentile(samples, 0.50) * 1000000, 2),
+        'p99_us': round(percentile(samples, 0.99) * 1000000, 2),
+        'mean_us': round(statistics.mean(samples) * 1000000, 2)
+    }
+
+def timings(function, items):
+
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        samples.append(time.perf_counter() - start)
+
+    return summary(samples)
+
+@contextlib.contextmanager
+def quiet():
+
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+def commit():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = ROOT, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment(workdir):
+
+    os.environ.update({
+        'S3_ARCHIVE': ARCHIVE,
+        'S3_BUCKET': BUCKET,
+        'S3_RESEARCH': RESEARCH,
+        'SSM_PARAMETER_ACCT': '/benchmark/acct',
+        'SSM_PARAMETER_KEY': '/benchmark/key',
+        'SSM_PARAMETER_ASN': '/benchmark/asn',
+        'SSM_PARAMETER_ASN_ETAG': '/benchmark/asn/etag',
+        'SSM_PARAMETER_CITY': '/benchmark/city',
+        'SSM_PARAMETER_CITY_ETAG': '/benchmark/city/etag',
+        'LAMBDA_FUNCTION': 'benchmark-search',
+        'LAMBDA_LAYER': 'benchmark-geolite2'
+    })
+
+    s3 = fakes.S3(os.path.join(workdir, 's3'))
+    ssm = fakes.SSM({
+        '/benchmark/acct': 'benchmark',
+        '/benchmark/key': 'benchmark',
+        '/benchmark/asn': 'EMPTY',
+        '/benchmark/asn/etag': 'EMPTY',
+        '/benchmark/city': 'EMPTY',
+        '/benchmark/city/etag': 'EMPTY'
+    })
+    client = fakes.Lambda()
+    fakes.install(s3, ssm, client)
+
+    os.makedirs(os.path.join(workdir, 's3', BUCKET), exist_ok = True)
+    for name in ('search.py', 'reverse.py'):
+        shutil.copyfile(os.path.join(ROOT, 'code', name), os.path.join(workdir, 's3', BUCKET, name))
+
+    return s3, ssm, client
+
+def refresh(directory, workdir):
+
+    s3, ssm, client = environment(workdir)
+
+    sys.path.insert(0, os.path.join(ROOT, 'download'))
+    import download
+
+    adapter = fakes.MaxMind(directory, fixtures.MODIFIED)
+    download.SESSION.mount('https://download.maxmind.com', adapter)
+
+    results = {}
+    for stage in ('cold', 'unchanged'):
+        start = time.perf_counter()
+        with quiet():
+            response = download.handler({}, None)
+        results[stage+'_s'] = round(time.perf_counter() - start, 3)
+        if response['statusCode'] != 200:
+            raise RuntimeError('Refresh failed: '+str(response))
+
+    import timeline
+
+    start = time.perf_counter()
+    with quiet():
+        while True:
+            response = timeline.handler({}, None)
+            if all(len(pending) == 0 for pending in json.loads(response['body']).values()):
+                break
+    results['timeline_s'] = round(time.perf_counter() - start, 3)
+
+    results['s3_requests'] = s3.requests
+    results['lambda_calls'] = client.calls
+
+    layer = os.path.join(workdir, 'opt')
+    with zipfile.ZipFile(os.path.join(workdir, 's3', BUCKET, 'geolite2.zip')) as zipf:
+        zipf.extractall(layer)
+        results['layer_bytes'] = sum(info.file_size for info in zipf.infolist())
+
+    return results, s3, layer
+
+def cold(layer, address, runs):
+
+    env = dict(os.environ)
+    env['MMDB_PATH'] = layer
+
+    samples = {'import_ms': [], 'first_ms': []}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', COLD, os.path.join(ROOT, 'code'), address], env = env, capture_output = True, text = True, check = True).stdout
+        measured = json.loads(output.strip().splitlines()[-1])
+        for key in samples:
+            samples[key].append(measured[key])
+
+    return {key: round(statistics.median(values), 2) for key, values in samples.items()}
+
+def lookups(layer, addresses, limit):
+
+    os.environ['MMDB_PATH'] = layer
+    os.environ['CACHE_SIZE'] = '0'
+    sys.path.insert(0, os.path.join(ROOT, 'code'))
+    import search
+
+    events = [{'rawQueryString': address} for address in addresses]
+    projected = [{'rawQueryString': address+'&fields=geo.c_iso&format=compact'} for address in addresses]
+
+    with quiet():
+        for event in events[:100]:
+            search.handler(event, None)
+        results = {
+            'single': timings(lambda event: search.handler(event, None), events),
+            'single_projected': timings(lambda event: search.handler(event, None), projected)
+        }
+
+    ipaddrs = [ipaddress.ip_address(address) for address in addresses]
+    start = time.perf_counter()
+    search.bulk(ipaddrs)
+    results['bulk_per_second'] = round(len(ipaddrs) / (time.perf_counter() - start))
+
+    size = min(limit, search.BATCH_LIMIT)
+    event = {
+        'rawQueryString': '',
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps(addresses[:size])
+    }
+    with quiet():
+        results['batch'] = timings(lambda event: search.handler(event, None), [event] * 5)
+    results['batch']['size'] = size
+
+    return results
+
+def history(s3, workdir, addresses):
+
+    sys.path.insert(0, os.path.join(ROOT, 'history'))
+    import history
+
+    events = [{'rawQueryString': address} for address in addresses]
+    results = {}
+
+    with quiet():
+        results['timeline'] = timings(lambda event: history.handler(event, None), events)
+
+    timeline = os.path.join(workdir, 's3', ARCHIVE, 'timeline')
+    hidden = os.path.join(workdir, 'timeline')
+    os.replace(timeline, hidden)
+
+    try:
+        for backend in ('range', 'cache'):
+            history.BACKEND = backend
+            with quiet():
+                results[backend] = timings(lambda event: history.handler(event, None), events)
+    finally:
+        os.replace(hidden, timeline)
+
+    return results
+
+def deltas(current, baseline):
+
+    changes = {}
+    for key, value in current.items():
+        previous = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            nested = deltas(value, previous)
+            if len(nested) > 0:
+                changes[key] = nested
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(previous, (int, float)) and previous != 0:
+            changes[key] = round((value - previous) / previous * 100, 1)
+    return changes
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--preset', choices = sorted(fixtures.PRESETS), default = 'small')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--fixtures', default = os.path.join(tempfile.gettempdir(), 'geolite2-benchmark'))
+    parser.add_argument('--count', type = int, default = 5000)
+    parser.add_argument('--history', type = int, default = 200)
+    parser.add_argument('--runs', type = int, default = 5)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    args = parser.parse_args(argv)
+
+    directory = fixtures.generate(os.path.join(args.fixtures, args.preset+'-'+str(args.seed)), args.preset, args.seed)
+
+    with open(os.path.join(directory, 'addresses.json'), 'r') as f:
+        addresses = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix = 'geolite2-benchmark-')
+
+    try:
+        results = {
+            'commit': commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'preset': args.preset,
+            'seed': args.seed
+        }
+
+        results['refresh'], s3, layer = refresh(directory, workdir)
+        results['cold_start'] = cold(layer, addresses[0], args.runs)
+        results['lookup'] = lookups(layer, addresses[:args.count], args.count)
+        results['history'] = history(s3, workdir, addresses[:args.history])
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            results['delta_percent'] = deltas(results, json.load(f))
+
+    output = json.dumps(results, indent = 4)
+    print(output)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(output+'\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
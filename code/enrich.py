@@ -0,0 +1,143 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import ipaddress
+import itertools
+import json
+import os
+import search
+import sys
+
+SECTIONS = ['geo', 'asn', 'ipaddress']
+
+CHUNK = 5000
+
+def documents(values):
+
+    unique = {}
+    parsed = []
+
+    for value in values:
+        try:
+            ipaddr = ipaddress.ip_address(str(value).strip())
+        except ValueError:
+            parsed.append(None)
+            continue
+        unique[ipaddr] = None
+        parsed.append(ipaddr)
+
+    for ipaddr, document in zip(list(unique), search.bulk(list(unique))):
+        unique[ipaddr] = document
+
+    results = []
+    for ipaddr in parsed:
+        if ipaddr is None:
+            results.append({'error': 'Invalid IP Address'})
+        else:
+            results.append({section: unique[ipaddr][section] for section in SECTIONS})
+
+    return results
+
+def chunks(rows, size):
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def enrich(rows, column = 'ip', workers = None, size = CHUNK):
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for chunk in chunks(rows, size):
+            for row, document in zip(chunk, documents([row.get(column) for row in chunk])):
+                row.update(document)
+                yield row
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = collections.deque()
+        for chunk in chunks(rows, size):
+            futures.append((chunk, executor.submit(documents, [row.get(column) for row in chunk])))
+            while len(futures) > workers * 2:
+                yield from merge(*futures.popleft())
+        while len(futures) > 0:
+            yield from merge(*futures.popleft())
+
+def merge(chunk, future):
+
+    for row, document in zip(chunk, future.result()):
+        row.update(document)
+        yield row
+
+def columns(fieldnames):
+
+    names = list(fieldnames)
+    for section, values in documents(['0.0.0.0'])[0].items():
+        names.extend([section+'_'+field for field in values])
+    names.append('error')
+    return names
+
+def flatten(row):
+
+    for section in SECTIONS:
+        values = row.pop(section, None)
+        if values is not None:
+            for field, value in values.items():
+                row[section+'_'+field] = value
+    return row
+
+def csvfile(reader, writer, column, workers, size):
+
+    rows = csv.DictReader(reader)
+    output = csv.DictWriter(writer, fieldnames = columns(rows.fieldnames or [column]), extrasaction = 'ignore')
+    output.writeheader()
+
+    for row in enrich(rows, column, workers, size):
+        output.writerow(flatten(row))
+
+def jsonlfile(reader, writer, column, workers, size):
+
+    rows = (json.loads(line) for line in reader if line.strip() != '')
+
+    for row in enrich(rows, column, workers, size):
+        writer.write(json.dumps(row, separators = (',', ':'))+'\n')
+
+FORMATS = {
+    'csv': csvfile,
+    'jsonl': jsonlfile
+}
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = search.DESC)
+    parser.add_argument('input', nargs = '?', default = '-')
+    parser.add_argument('-o', '--output', default = '-')
+    parser.add_argument('-f', '--format', choices = sorted(FORMATS))
+    parser.add_argument('-c', '--column', default = 'ip')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('-s', '--chunk', type = int, default = CHUNK)
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'csv' if args.input.endswith('.csv') else 'jsonl'
+
+    reader = sys.stdin if args.input == '-' else open(args.input, 'r', newline = '')
+    writer = sys.stdout if args.output == '-' else open(args.output, 'w', newline = '')
+
+    try:
+        FORMATS[fmt](reader, writer, args.column, args.workers, args.chunk)
+    finally:
+        if reader is not sys.stdin:
+            reader.close()
+        if writer is not sys.stdout:
+            writer.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import ipaddress
+import os
+import threading
+import time
+
+import search
+
+PATH = os.path.join(search.MMDB_PATH, 'reverse.idx')
+
+MAGIC = b'GEOREV02'
+
+KINDS = {
+    'asn': 'asn',
+    'org': 'asn',
+    'country': 'city',
+    'subdivision': 'city'
+}
+
+LIMIT = int(os.environ.get('REVERSE_LIMIT', '100'))
+
+LIMIT_MAX = int(os.environ.get('REVERSE_LIMIT_MAX', '1000'))
+
+class Inverted:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.table = None
+
+    def load(self):
+        if self.table is None:
+            with self.lock:
+                if self.table is None:
+                    loaded = search.mapped(PATH, MAGIC)
+                    if loaded is None:
+                        self.table = False
+                    else:
+                        self.table = {'header': loaded[1], 'arrays': loaded[2]}
+        return self.table
+
+    def find(self, kind, key):
+        arrays = self.load()['arrays']
+        keys = arrays[kind+'_keys']
+        offsets = arrays[kind+'_key_offset']
+
+        key = key.encode('utf-8')
+        low = 0
+        high = len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if keys[int(offsets[middle]):int(offsets[middle + 1])].tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(offsets) - 1 and keys[int(offsets[low]):int(offsets[low + 1])].tobytes() == key:
+            return low
+        return None
+
+    def postings(self, kind, key, cursor, limit):
+        slot = self.find(kind, key)
+        if slot is None:
+            return 0, []
+
+        arrays = self.load()['arrays']
+        first = int(arrays[kind+'_posting_offset'][slot])
+        last = int(arrays[kind+'_posting_offset'][slot + 1])
+
+        return last - first, arrays[kind+'_postings'][min(first + cursor, last):min(first + cursor + limit, last)].tolist()
+
+INVERTED = Inverted()
+
+def normalize(kind, value):
+
+    value = value.strip()
+
+    if kind == 'asn':
+        if value[:2].upper() == 'AS':
+            value = value[2:]
+        return str(int(value))
+    if kind == 'org':
+        return value.casefold()
+
+    return value.upper()
+
+def networks(source, rows):
+
+    table = search.INTERVALS.table('geolite2')
+    if not table:
+        return None
+
+    arrays = table['arrays']
+    count = INVERTED.load()['header']['rows']
+
+    if len(arrays['v4_start']) != count[0] or len(arrays['v6_start']) != count[1]:
+        print('Reverse Index: geolite2.idx does not match reverse.idx')
+        return None
+
+    results = []
+    for row in rows:
+        if row < count[0]:
+            start = ipaddress.IPv4Address(int(arrays['v4_start'][row]))
+            prefixlen = int(arrays['v4_'+source+'_prefix'][row])
+        else:
+            row -= count[0]
+            start = ipaddress.IPv6Address(arrays['v6_start'][row:row + 1].tobytes())
+            prefixlen = int(arrays['v6_'+source+'_prefix'][row])
+        results.append(str(start)+'/'+str(prefixlen))
+
+    return results
+
+def query(params):
+
+    kinds = [kind for kind in KINDS if kind in params]
+    if len(kinds) != 1:
+        return 400, 'Invalid Reverse Query'
+    kind = kinds[0]
+
+    try:
+        key = normalize(kind, params[kind])
+        cursor = int(params.get('cursor', '0'))
+        limit = min(int(params.get('limit', str(LIMIT))), LIMIT_MAX)
+    except ValueError:
+        return 400, 'Invalid Reverse Query'
+
+    if cursor < 0 or limit < 1:
+        return 400, 'Invalid Reverse Query'
+
+    if not INVERTED.load():
+        return 503, 'Reverse Index Unavailable'
+
+    start = time.perf_counter()
+    total, values = INVERTED.postings(kind, key, cursor, limit)
+    search.METRICS.record('Postings', start)
+
+    start = time.perf_counter()
+    source = KINDS[kind]
+    if kind == 'org':
+        results = values
+    else:
+        results = networks(source, values)
+    search.METRICS.record('Networks', start)
+
+    if results is None:
+        return 503, 'Reverse Index Unavailable'
+
+    msg = {
+        kind: params[kind],
+        'total': total,
+        'cursor': cursor,
+        'next': cursor + len(results) if cursor + len(results) < total else None,
+        'asns' if kind == 'org' else 'networks': results,
+        'attribution': search.DESC,
+        'geolite2-'+source+'.mmdb': search.READERS.version(source)
+    }
+
+    return 200, msg
+
+def respond(event):
+
+    ip, params = search.parameters(event)
+
+    code, msg = query(params)
+
+    start = time.perf_counter()
+    body = search.dumps(msg, params)
+    search.METRICS.record('Serialize', start)
+
+    return {
+        'statusCode': code,
+        'body': body
+    }
@@ -1,134 +1,1088 @@
-import geoip2.database
+import base64
+import bisect
+import collections
 import ipaddress
 import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
 
-def handler(event, context):
+MMDB_PATH = os.environ.get('MMDB_PATH', '/opt')
 
-    print(event)
+DATABASES = {
+    'asn': (os.path.join(MMDB_PATH, 'GeoLite2-ASN.mmdb'), os.path.join(MMDB_PATH, 'asn.updated')),
+    'city': (os.path.join(MMDB_PATH, 'GeoLite2-City.mmdb'), os.path.join(MMDB_PATH, 'city.updated'))
+}
 
-    ip = event['rawQueryString']
+INDEXES = {
+    'geolite2': os.path.join(MMDB_PATH, 'geolite2.idx')
+}
 
-    try:
+NETWORKS = {
+    'asn': 'net',
+    'city': 'cidr'
+}
 
-        ipaddr = ipaddress.ip_address(ip)
-        multicast = ipaddr.is_multicast
-        private = ipaddr.is_private
-        globalpublic = ipaddr.is_global
-        unspecified = ipaddr.is_unspecified
-        reserved = ipaddr.is_reserved
-        loopback = ipaddr.is_loopback
-        link_local = ipaddr.is_link_local
-        try:
-            site_local = ipaddr.is_site_local
-        except:
-            site_local = None
-        version = ipaddress.ip_network(ip).version
-        try:
-            ipv4mapped = ipaddr.ipv4_mapped
-        except:
-            ipv4mapped = None
-        try:
-            ipv6mapped = ipaddr.ipv6_mapped
-        except:
-            ipv6mapped = None
-        try:
-            sixtofour = ipaddr.sixtofour
-        except:
-            sixtofour = None
-        try:
-            teredo = ipaddr.teredo
-        except:
-            teredo = None
+PHASES = {
+    'asn': 'ASN',
+    'city': 'City'
+}
 
-        try:
-            with geoip2.database.Reader('GeoLite2-City.mmdb') as reader:
-                response = reader.city(ip)
-                country_code = response.country.iso_code
-                country_name = response.country.name
-                state_code = response.subdivisions.most_specific.iso_code
-                state_name = response.subdivisions.most_specific.name
-                city_name = response.city.name
-                zip_code = response.postal.code
-                latitude = response.location.latitude
-                longitude = response.location.longitude
-                cidr = response.traits.network
-        except:
-            country_code = None
-            country_name = None
-            state_code = None
-            state_name = None
-            city_name = None
-            zip_code = None
-            latitude = None
-            longitude = None
-            cidr = None
+MAGIC = b'GEOIDX02'
 
-        try:
-            with geoip2.database.Reader('GeoLite2-ASN.mmdb') as reader2:
-                response2 = reader2.asn(ip)
-                asn = response2.autonomous_system_number
-                org = response2.autonomous_system_organization
-                net = response2.network
-        except:
-            asn = None
-            org = None
-            net = None
-
-        f = open('asn.updated', 'r')
-        asnupdated = f.read()
-        f.close()
-
-        f = open('city.updated', 'r')
-        cityupdated = f.read()
-        f.close()
-
-        desc = 'This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.'
+NONE = 0xFFFFFFFF
+
+MODES = {
+    'file': 'MODE_FILE',
+    'memory': 'MODE_MEMORY',
+    'mmap': 'MODE_MMAP'
+}
+
+PAGE = 4096
+
+WARNED = set()
+
+class Readers:
+
+    def __init__(self, mode):
+        self.mode = MODES.get(mode, 'MODE_MMAP')
+        self.lock = threading.Lock()
+        self.readers = {}
+        self.versions = {}
+
+    def reader(self, name):
+        reader = self.readers.get(name)
+        if reader is None:
+            with self.lock:
+                reader = self.readers.get(name)
+                if reader is None:
+                    import geoip2.database
+                    import maxminddb
+                    reader = geoip2.database.Reader(DATABASES[name][0], mode = getattr(maxminddb, self.mode))
+                    self.readers[name] = reader
+        return reader
+
+    def version(self, name):
+        version = self.versions.get(name)
+        if version is None:
+            with open(DATABASES[name][1], 'r') as f:
+                version = f.read()
+            self.versions[name] = version
+        return version
+
+    def reset(self, name):
+        with self.lock:
+            reader = self.readers.pop(name, None)
+            self.versions.pop(name, None)
+        if reader is not None:
+            try:
+                reader.close()
+            except Exception:
+                pass
+
+class NetworkCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.prefixes = {4: collections.Counter(), 6: collections.Counter()}
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self, version):
+        self.entries.clear()
+        self.prefixes[4].clear()
+        self.prefixes[6].clear()
+        self.version = version
+
+    def get(self, ipaddr, version):
+        with self.lock:
+            if version != self.version:
+                self.clear(version)
+            value = int(ipaddr)
+            for prefixlen in self.prefixes[ipaddr.version]:
+                key = (ipaddr.version, prefixlen, value >> (ipaddr.max_prefixlen - prefixlen))
+                record = self.entries.get(key)
+                if record is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return record
+            self.misses += 1
+        return None
+
+    def put(self, network, record, version):
+        if network is None or self.size <= 0:
+            return
+        with self.lock:
+            if version != self.version:
+                self.clear(version)
+            key = (network.version, network.prefixlen, int(network.network_address) >> (network.max_prefixlen - network.prefixlen))
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = record
+            self.prefixes[network.version][network.prefixlen] += 1
+            while len(self.entries) > self.size:
+                (ipversion, prefixlen, _), _ = self.entries.popitem(last = False)
+                self.prefixes[ipversion][prefixlen] -= 1
+                if self.prefixes[ipversion][prefixlen] == 0:
+                    del self.prefixes[ipversion][prefixlen]
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'version': self.version
+        }
+
+class Metrics:
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.cold = True
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.counts = {}
+
+    def record(self, phase, start):
+        self.phases[phase] = self.phases.get(phase, 0.0) + (time.perf_counter() - start) * 1000
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def emit(self, method, code, context):
+        if self.namespace == '':
+            return
+        self.phases['Total'] = (time.perf_counter() - self.started) * 1000
+        self.counts['ColdStart'] = 1 if self.cold else 0
+        self.cold = False
+
+        metrics = [{'Name': name, 'Unit': 'Milliseconds'} for name in self.phases]
+        metrics.extend([{'Name': name, 'Unit': 'Count'} for name in self.counts])
 
-        code = 200
         msg = {
-            'ip':str(ipaddr),
-            'geo': {
-                'country':country_name,
-                'c_iso':country_code,
-                'state':state_name,
-                's_iso':state_code,
-                'city':city_name,
-                'zip':zip_code,
-                'latitude':latitude,
-                'longitude':longitude,
-                'cidr':str(cidr)
-            },
-            'asn': {
-                'id': asn,
-                'org': org,
-                'net': str(net)
-            },
-            'ipaddress': {
-                'version': version,
-                'multicast': multicast,
-                'private': private,
-                'global': globalpublic,
-                'unspecified': unspecified,
-                'reserved': reserved,
-                'loopback': loopback,
-                'link_local': link_local,
-                'site_local': site_local,
-                'ipv4_mapped': str(ipv4mapped),
-                'ipv6_mapped': str(ipv6mapped),
-                'sixtofour': str(sixtofour),
-                'teredo': str(teredo)
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Method']],
+                    'Metrics': metrics
+                }]
             },
-            'attribution':desc,
-            'geolite2-asn.mmdb':asnupdated,
-            'geolite2-city.mmdb':cityupdated
+            'Method': method,
+            'StatusCode': code,
+            'RequestId': getattr(context, 'aws_request_id', None),
+            'cache': stats()
+        }
+        msg.update({name: round(value, 3) for name, value in self.phases.items()})
+        msg.update(self.counts)
+
+        for name in DATABASES:
+            try:
+                msg['geolite2-'+name+'.mmdb'] = READERS.version(name)
+            except OSError:
+                msg['geolite2-'+name+'.mmdb'] = None
+
+        print(json.dumps(msg, separators = (',', ':')))
+
+def mapped(path, magic):
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        import numpy
+    except ImportError as e:
+        if 'numpy' not in WARNED:
+            WARNED.add('numpy')
+            print('Index Unavailable: '+str(e), file = sys.stderr)
+        return None
+
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            return None
+        start = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(start - len(magic) - 8).rstrip(b'\x00'))
+
+    arrays = {}
+    for key, (dtype, offset, count) in header['arrays'].items():
+        if count == 0:
+            arrays[key] = numpy.zeros(0, dtype = dtype)
+        else:
+            arrays[key] = numpy.memmap(path, dtype = dtype, mode = 'r', offset = start + offset, shape = (count,))
+
+    return numpy, header, arrays
+
+class Intervals:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def table(self, index):
+        table = self.tables.get(index)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(index)
+                if table is None:
+                    table = self.load(index)
+                    self.tables[index] = table
+        return table
+
+    def load(self, index):
+        loaded = mapped(INDEXES[index], MAGIC)
+        if loaded is None:
+            return False
+
+        numpy, header, arrays = loaded
+
+        aliases = []
+        for network, offset in header['aliases']:
+            network = ipaddress.ip_network(network)
+            aliases.append((int(network.netmask), int(network.network_address), offset))
+
+        return {
+            'numpy': numpy,
+            'arrays': arrays,
+            'aliases': aliases,
+            'sources': header['sources'],
+            'ip_version': header['ip_version']
+        }
+
+    def translate(self, table, ipaddr):
+        if ipaddr.version == 4:
+            return 4, int(ipaddr), 0
+        if table['ip_version'] == 4:
+            return None, None, 0
+        value = int(ipaddr)
+        for mask, network, offset in table['aliases']:
+            if value & mask == network:
+                return 4, (value >> (96 - offset)) & 0xFFFFFFFF, offset
+        return 6, ipaddr.packed, 0
+
+    def record(self, table, source, rid):
+        offsets = table['arrays'][source+'_offset']
+        return json.loads(table['arrays'][source+'_records'][int(offsets[rid]):int(offsets[rid + 1])].tobytes())
+
+    def segments(self, table, network, cursor):
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        position = int(cursor) if cursor is not None else first
+        if network.version == 4:
+            return [(4, first, last, None, position)]
+        if table['ip_version'] == 4:
+            return []
+        found = []
+        for mask, base, offset in table['aliases']:
+            shift = 96 - offset
+            if network.prefixlen >= offset and first & mask == base:
+                return [(4, (first >> shift) & 0xFFFFFFFF, (last >> shift) & 0xFFFFFFFF, (base, offset), (position >> shift) & 0xFFFFFFFF)]
+            end = base | (~mask & ((1 << 128) - 1))
+            if first <= base and end <= last and position <= end:
+                found.append((4, 0, 0xFFFFFFFF, (base, offset), (max(position, base) >> shift) & 0xFFFFFFFF))
+        found.append((6, first, last, None, position))
+        return found
+
+    def widen(self, version, alias, value, prefixlen):
+        if alias is not None:
+            base, offset = alias
+            return ipaddress.IPv6Network((base | (value << (96 - offset)), offset + prefixlen))
+        if version == 4:
+            return ipaddress.IPv4Network((value, prefixlen))
+        return ipaddress.IPv6Network((value, prefixlen))
+
+    def rows(self, table, source, version, first, last, alias, position, limit):
+        numpy = table['numpy']
+        arrays = table['arrays']
+        prefix = 'v'+str(version)+'_'
+        starts = arrays[prefix+'start']
+        ends = arrays[prefix+'end']
+        bits = 32 if version == 4 else 128
+
+        def key(value):
+            return numpy.array([value if version == 4 else value.to_bytes(16, 'big')], dtype = starts.dtype)
+
+        if position > first:
+            low = int(numpy.searchsorted(starts, key(position), side = 'left')[0])
+        else:
+            low = int(numpy.searchsorted(ends, key(first), side = 'left')[0])
+        end = int(numpy.searchsorted(starts, key(last), side = 'right')[0])
+
+        found = []
+        opened = position <= first
+
+        while low < end and len(found) <= limit:
+            high = min(end, low + limit + 1)
+
+            if version == 4:
+                values = starts[low:high].tolist()
+            else:
+                data = starts[low:high].tobytes()
+                values = [int.from_bytes(data[offset:offset + 16], 'big') for offset in range(0, len(data), 16)]
+
+            rids = arrays[prefix+source+'_record'][low:high].tolist()
+            prefixes = arrays[prefix+source+'_prefix'][low:high].tolist()
+
+            for value, rid, prefixlen in zip(values, rids, prefixes):
+                network = value >> (bits - prefixlen) << (bits - prefixlen)
+                if rid != NONE and (network == value or opened):
+                    found.append((self.widen(version, alias, network, prefixlen), rid))
+                opened = False
+
+            low = high
+
+        return found
+
+    def scan(self, source, network, cursor, limit):
+        table = self.table('geolite2')
+        if not table:
+            return None
+
+        found = []
+        for version, first, last, alias, position in self.segments(table, network, cursor):
+            found.extend(self.rows(table, source, version, first, last, alias, position, limit))
+        found.sort(key = lambda row: row[0].network_address)
+
+        return found[:limit + 1]
+
+    def locate(self, index, ipaddrs, sources = None):
+        table = self.table(index)
+        if not table:
+            return None
+
+        if sources is None:
+            sources = list(table['sources'])
+
+        numpy = table['numpy']
+        arrays = table['arrays']
+
+        queries = {4: [], 6: []}
+        results = {source: [None] * len(ipaddrs) for source in sources}
+
+        for position, ipaddr in enumerate(ipaddrs):
+            version, value, offset = self.translate(table, ipaddr)
+            if version is None:
+                continue
+            queries[version].append((position, value, offset))
+
+        for version, items in queries.items():
+            if len(items) == 0:
+                continue
+            prefix = 'v'+str(version)+'_'
+            starts = arrays[prefix+'start']
+            if len(starts) == 0:
+                continue
+            keys = numpy.array([value for _, value, _ in items], dtype = starts.dtype)
+            slots = numpy.searchsorted(starts, keys, side = 'right') - 1
+            clipped = numpy.maximum(slots, 0)
+            found = ((slots >= 0) & (arrays[prefix+'end'][clipped] >= keys)).tolist()
+            for source in sources:
+                rids = arrays[prefix+source+'_record'][clipped].tolist()
+                prefixes = arrays[prefix+source+'_prefix'][clipped].tolist()
+                records = {}
+                for (position, _, offset), hit, rid, prefixlen in zip(items, found, rids, prefixes):
+                    if not hit or rid == NONE:
+                        continue
+                    if rid not in records:
+                        records[rid] = self.record(table, source, rid)
+                    record = dict(records[rid])
+                    record[NETWORKS[source]] = str(ipaddress.ip_network((ipaddrs[position], offset + prefixlen), strict = False))
+                    results[source][position] = record
+
+        for source in sources:
+            for position in range(len(ipaddrs)):
+                if results[source][position] is None:
+                    record = dict.fromkeys(table['sources'][source])
+                    record[NETWORKS[source]] = 'None'
+                    results[source][position] = record
+
+        return results
+
+PRELOAD = os.environ.get('PRELOAD', 'open')
+
+WARMUP = ['1.1.1.1', '2606:4700:4700::1111']
+
+BATCH_LIMIT = int(os.environ.get('BATCH_LIMIT', '5000'))
+
+RANGE_LIMIT = int(os.environ.get('RANGE_LIMIT', '1000'))
+
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', '10000'))
+
+LOG_EVENTS = float(os.environ.get('LOG_EVENTS', '1'))
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'GeoLite2/Search')
+
+DESC = 'This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.'
+
+READERS = Readers(os.environ.get('MMDB_MODE', 'mmap'))
+
+INTERVALS = Intervals()
+
+METRICS = Metrics(METRICS_NAMESPACE)
+
+CACHES = {
+    'asn': NetworkCache(CACHE_SIZE),
+    'city': NetworkCache(CACHE_SIZE)
+}
+
+def stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+def geo(ipaddr):
+
+    version = READERS.version('city')
+    record = CACHES['city'].get(ipaddr, version)
+    if record is not None:
+        return record
+
+    country_code = None
+    country_name = None
+    state_code = None
+    state_name = None
+    city_name = None
+    zip_code = None
+    latitude = None
+    longitude = None
+    cidr = None
+    network = None
+
+    import geoip2.errors
+
+    try:
+        response = READERS.reader('city').city(ipaddr)
+        country_code = response.country.iso_code
+        country_name = response.country.name
+        state_code = response.subdivisions.most_specific.iso_code
+        state_name = response.subdivisions.most_specific.name
+        city_name = response.city.name
+        zip_code = response.postal.code
+        latitude = response.location.latitude
+        longitude = response.location.longitude
+        cidr = response.traits.network
+        network = cidr
+    except geoip2.errors.AddressNotFoundError as e:
+        network = getattr(e, 'network', None)
+    except ValueError:
+        pass
+    except Exception:
+        READERS.reset('city')
+
+    record = {
+        'country':country_name,
+        'c_iso':country_code,
+        'state':state_name,
+        's_iso':state_code,
+        'city':city_name,
+        'zip':zip_code,
+        'latitude':latitude,
+        'longitude':longitude,
+        'cidr':str(cidr)
+    }
+
+    CACHES['city'].put(network, record, version)
+
+    return record
+
+def asn(ipaddr):
+
+    version = READERS.version('asn')
+    record = CACHES['asn'].get(ipaddr, version)
+    if record is not None:
+        return record
+
+    number = None
+    org = None
+    net = None
+    network = None
+
+    import geoip2.errors
+
+    try:
+        response = READERS.reader('asn').asn(ipaddr)
+        number = response.autonomous_system_number
+        org = response.autonomous_system_organization
+        net = response.network
+        network = net
+    except geoip2.errors.AddressNotFoundError as e:
+        network = getattr(e, 'network', None)
+    except ValueError:
+        pass
+    except Exception:
+        READERS.reset('asn')
+
+    record = {
+        'id': number,
+        'org': org,
+        'net': str(net)
+    }
+
+    CACHES['asn'].put(network, record, version)
+
+    return record
+
+MULTICAST = 1
+PRIVATE = 2
+GLOBAL = 4
+UNSPECIFIED = 8
+RESERVED = 16
+LOOPBACK = 32
+LINK_LOCAL = 64
+SITE_LOCAL = 128
+EXCEPTION = 256
+SHARED = 512
+
+SPECIAL = {
+    4: [
+        ('0.0.0.0/8', PRIVATE),
+        ('0.0.0.0/32', UNSPECIFIED),
+        ('10.0.0.0/8', PRIVATE),
+        ('100.64.0.0/10', SHARED),
+        ('127.0.0.0/8', PRIVATE | LOOPBACK),
+        ('169.254.0.0/16', PRIVATE | LINK_LOCAL),
+        ('172.16.0.0/12', PRIVATE),
+        ('192.0.0.0/24', PRIVATE),
+        ('192.0.0.9/32', EXCEPTION),
+        ('192.0.0.10/32', EXCEPTION),
+        ('192.0.0.170/31', PRIVATE),
+        ('192.0.2.0/24', PRIVATE),
+        ('192.168.0.0/16', PRIVATE),
+        ('198.18.0.0/15', PRIVATE),
+        ('198.51.100.0/24', PRIVATE),
+        ('203.0.113.0/24', PRIVATE),
+        ('224.0.0.0/4', MULTICAST),
+        ('240.0.0.0/4', PRIVATE | RESERVED),
+        ('255.255.255.255/32', PRIVATE)
+    ],
+    6: [
+        ('::/8', RESERVED),
+        ('::/128', PRIVATE | UNSPECIFIED),
+        ('::1/128', PRIVATE | LOOPBACK),
+        ('64:ff9b:1::/48', PRIVATE),
+        ('100::/8', RESERVED),
+        ('100::/64', PRIVATE),
+        ('200::/7', RESERVED),
+        ('400::/6', RESERVED),
+        ('800::/5', RESERVED),
+        ('1000::/4', RESERVED),
+        ('2001::/23', PRIVATE),
+        ('2001:1::1/128', EXCEPTION),
+        ('2001:1::2/128', EXCEPTION),
+        ('2001:3::/32', EXCEPTION),
+        ('2001:4:112::/48', EXCEPTION),
+        ('2001:20::/28', EXCEPTION),
+        ('2001:30::/28', EXCEPTION),
+        ('2001:db8::/32', PRIVATE),
+        ('2002::/16', PRIVATE),
+        ('3fff::/20', PRIVATE),
+        ('4000::/3', RESERVED),
+        ('6000::/3', RESERVED),
+        ('8000::/3', RESERVED),
+        ('a000::/3', RESERVED),
+        ('c000::/3', RESERVED),
+        ('e000::/4', RESERVED),
+        ('f000::/5', RESERVED),
+        ('f800::/6', RESERVED),
+        ('fc00::/7', PRIVATE),
+        ('fe00::/9', RESERVED),
+        ('fe80::/10', PRIVATE | LINK_LOCAL),
+        ('fec0::/10', SITE_LOCAL),
+        ('ff00::/8', MULTICAST)
+    ]
+}
+
+def ranges(entries, width):
+
+    networks = []
+    points = {0}
+    for cidr, flags in entries:
+        network = ipaddress.ip_network(cidr)
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        networks.append((start, end, flags))
+        points.add(start)
+        if end + 1 < 1 << width:
+            points.add(end + 1)
+
+    starts = sorted(points)
+    bitsets = []
+    for point in starts:
+        flags = 0
+        for start, end, value in networks:
+            if start <= point <= end:
+                flags |= value
+        if flags & EXCEPTION:
+            flags &= ~PRIVATE
+        if not flags & (PRIVATE | SHARED):
+            flags |= GLOBAL
+        bitsets.append(flags & ~(EXCEPTION | SHARED))
+
+    return starts, bitsets
+
+TABLES = {
+    4: ranges(SPECIAL[4], 32),
+    6: ranges(SPECIAL[6], 128)
+}
+
+def dotted(value):
+
+    return '.'.join(str(octet) for octet in value.to_bytes(4, 'big'))
+
+def bitset(version, value):
+
+    if version == 6 and value >> 32 == 0xFFFF:
+        version = 4
+        value &= 0xFFFFFFFF
+
+    starts, bitsets = TABLES[version]
+
+    return bitsets[bisect.bisect_right(starts, value) - 1]
+
+def bitsets(ipaddrs):
+
+    return [bitset(ipaddr.version, int(ipaddr)) for ipaddr in ipaddrs]
+
+def classify(ipaddr, flags = None):
+
+    version = ipaddr.version
+    value = int(ipaddr)
+
+    if flags is None:
+        flags = bitset(version, value)
+
+    site_local = None
+    ipv4mapped = None
+    ipv6mapped = None
+    sixtofour = None
+    teredo = None
+
+    if version == 4:
+        ipv6mapped = '::ffff:'+dotted(value)
+    else:
+        site_local = bool(flags & SITE_LOCAL)
+        if value >> 32 == 0xFFFF:
+            ipv4mapped = dotted(value & 0xFFFFFFFF)
+        if value >> 112 == 0x2002:
+            sixtofour = dotted((value >> 80) & 0xFFFFFFFF)
+        if value >> 96 == 0x20010000:
+            teredo = "(IPv4Address('"+dotted((value >> 64) & 0xFFFFFFFF)+"'), IPv4Address('"+dotted(~value & 0xFFFFFFFF)+"'))"
+
+    return {
+        'version': version,
+        'multicast': bool(flags & MULTICAST),
+        'private': bool(flags & PRIVATE),
+        'global': bool(flags & GLOBAL),
+        'unspecified': bool(flags & UNSPECIFIED),
+        'reserved': bool(flags & RESERVED),
+        'loopback': bool(flags & LOOPBACK),
+        'link_local': bool(flags & LINK_LOCAL),
+        'site_local': site_local,
+        'ipv4_mapped': str(ipv4mapped),
+        'ipv6_mapped': str(ipv6mapped),
+        'sixtofour': str(sixtofour),
+        'teredo': str(teredo)
+    }
+
+FIELDS = {
+    'geo': ['country', 'c_iso', 'state', 's_iso', 'city', 'zip', 'latitude', 'longitude', 'cidr'],
+    'asn': ['id', 'org', 'net'],
+    'ipaddress': ['version', 'multicast', 'private', 'global', 'unspecified', 'reserved', 'loopback', 'link_local', 'site_local', 'ipv4_mapped', 'ipv6_mapped', 'sixtofour', 'teredo']
+}
+
+def parameters(event):
+
+    ip = None
+    params = {}
+
+    for part in (event.get('rawQueryString') or '').split('&'):
+        if part == '':
+            continue
+        if '=' in part:
+            key, value = part.split('=', 1)
+            params[urllib.parse.unquote_plus(key)] = urllib.parse.unquote_plus(value)
+        elif ip is None:
+            ip = urllib.parse.unquote(part)
+
+    return params.get('ip', ip), params
+
+def projection(value):
+
+    if value is None or value.strip() == '':
+        return None
+
+    selected = {}
+
+    for item in value.split(','):
+        section, _, field = item.strip().partition('.')
+        if section not in FIELDS or (field != '' and field not in FIELDS[section]):
+            raise ValueError(item)
+        if field == '':
+            selected[section] = set(FIELDS[section])
+        else:
+            selected.setdefault(section, set()).add(field)
+
+    return {section: [field for field in FIELDS[section] if field in selected[section]] for section in FIELDS if section in selected}
+
+def project(document, selected):
+
+    if selected is None:
+        return document
+
+    result = {'ip': document['ip']}
+    for section, fields in selected.items():
+        result[section] = {field: document[section][field] for field in fields}
+
+    return result
+
+def versions(msg, selected):
+
+    if selected is None or 'asn' in selected:
+        msg['geolite2-asn.mmdb'] = READERS.version('asn')
+    if selected is None or 'geo' in selected:
+        msg['geolite2-city.mmdb'] = READERS.version('city')
+
+    return msg
+
+def dumps(msg, params):
+
+    if params.get('format') == 'compact':
+        return json.dumps(msg, separators = (',', ':'))
+
+    return json.dumps(msg, indent = 4)
+
+def lookup(ipaddr, selected = None):
+
+    if INTERVALS.table('geolite2'):
+        return bulk([ipaddr], selected)[0]
+
+    document = {'ip': str(ipaddr)}
+
+    if selected is None or 'geo' in selected:
+        start = time.perf_counter()
+        document['geo'] = geo(ipaddr)
+        METRICS.record('City', start)
+    if selected is None or 'asn' in selected:
+        start = time.perf_counter()
+        document['asn'] = asn(ipaddr)
+        METRICS.record('ASN', start)
+    if selected is None or 'ipaddress' in selected:
+        start = time.perf_counter()
+        document['ipaddress'] = classify(ipaddr)
+        METRICS.record('Classify', start)
+
+    return project(document, selected)
+
+def bulk(ipaddrs, selected = None):
+
+    sections = {}
+
+    wanted = {}
+    for section, source in (('geo', 'city'), ('asn', 'asn')):
+        if selected is None or section in selected:
+            wanted[source] = section
+
+    if len(wanted) > 0:
+        start = time.perf_counter()
+        located = INTERVALS.locate('geolite2', ipaddrs, list(wanted))
+        if located:
+            for source, section in wanted.items():
+                sections[section] = located[source]
+            METRICS.record('Locate', start)
+        else:
+            for source, section in wanted.items():
+                start = time.perf_counter()
+                if source == 'city':
+                    sections[section] = [geo(ipaddr) for ipaddr in ipaddrs]
+                else:
+                    sections[section] = [asn(ipaddr) for ipaddr in ipaddrs]
+                METRICS.record(PHASES[source], start)
+
+    if selected is None or 'ipaddress' in selected:
+        start = time.perf_counter()
+        flags = bitsets(ipaddrs)
+        sections['ipaddress'] = [classify(ipaddr, flags[position]) for position, ipaddr in enumerate(ipaddrs)]
+        METRICS.record('Classify', start)
+
+    documents = []
+    for position, ipaddr in enumerate(ipaddrs):
+        document = {'ip': str(ipaddr)}
+        for section, values in sections.items():
+            document[section] = values[position]
+        documents.append(project(document, selected))
+
+    return documents
+
+def addresses(event):
+
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    body = body.strip()
+
+    if body.startswith('['):
+        items = json.loads(body)
+    else:
+        items = body.splitlines()
+
+    return [str(item).strip() for item in items if str(item).strip() != '']
+
+def batch(event, selected):
+
+    start = time.perf_counter()
+
+    try:
+        items = addresses(event)
+    except (ValueError, UnicodeDecodeError):
+        return 400, 'Invalid Batch Body'
+
+    METRICS.count('Addresses', len(items))
+
+    if len(items) > BATCH_LIMIT:
+        return 413, 'Batch Limit '+str(BATCH_LIMIT)+' Addresses'
+
+    unique = {}
+    parsed = []
+
+    for item in items:
+        try:
+            ipaddr = ipaddress.ip_address(item)
+        except ValueError:
+            parsed.append((item, None))
+            continue
+        unique[ipaddr] = None
+        parsed.append((item, ipaddr))
+
+    METRICS.record('Parse', start)
+
+    for ipaddr, document in zip(list(unique), bulk(list(unique), selected)):
+        unique[ipaddr] = document
+
+    results = []
+    for item, ipaddr in parsed:
+        if ipaddr is None:
+            results.append({'ip': item, 'error': 'Invalid IP Address'})
+        else:
+            results.append(unique[ipaddr])
+
+    msg = {
+        'count': len(results),
+        'unique': len(unique),
+        'results': results,
+        'attribution': DESC
+    }
+
+    return 200, versions(msg, selected)
+
+def ranged(ip, params, selected):
+
+    start = time.perf_counter()
+
+    try:
+        network = ipaddress.ip_network(ip, strict = False)
+        limit = min(int(params.get('limit', str(RANGE_LIMIT))), RANGE_LIMIT)
+        cursor = ipaddress.ip_address(params['cursor']) if 'cursor' in params else None
+    except ValueError:
+        return 400, 'Invalid Range Query'
+
+    if limit < 1 or (cursor is not None and cursor not in network):
+        return 400, 'Invalid Range Query'
+
+    if selected is not None and 'ipaddress' in selected:
+        return 400, 'Invalid Field'
+
+    METRICS.record('Parse', start)
+
+    start = time.perf_counter()
+
+    scans = {}
+    for section, source in (('geo', 'city'), ('asn', 'asn')):
+        if selected is None or section in selected:
+            scans[section] = (source, INTERVALS.scan(source, network, cursor, limit))
+            if scans[section][1] is None:
+                return 503, 'Range Index Unavailable'
+
+    boundary = None
+    for source, rows in scans.values():
+        if len(rows) > limit:
+            boundary = rows[limit][0].network_address if boundary is None else min(boundary, rows[limit][0].network_address)
+
+    msg = {'cidr': str(network)}
+    count = 0
+
+    table = INTERVALS.table('geolite2')
+
+    for section, (source, rows) in scans.items():
+        records = {}
+        results = []
+        for subnet, rid in rows:
+            if boundary is not None and subnet.network_address >= boundary:
+                break
+            if rid not in records:
+                records[rid] = INTERVALS.record(table, source, rid)
+            record = dict(records[rid])
+            record[NETWORKS[source]] = str(subnet)
+            if selected is not None:
+                record = {field: record[field] for field in selected[section]}
+            results.append(record)
+        msg[section] = results
+        count += len(results)
+
+    METRICS.record('Scan', start)
+
+    msg['count'] = count
+    msg['next'] = str(boundary) if boundary is not None else None
+    msg['attribution'] = DESC
+
+    return 200, versions(msg, selected)
+
+def method(event):
+
+    return event.get('requestContext', {}).get('http', {}).get('method', 'GET')
+
+def respond(event):
+
+    if event.get('rawPath') == '/reverse':
+        import reverse
+        return reverse.respond(event)
+
+    start = time.perf_counter()
+
+    ip, params = parameters(event)
+
+    try:
+        selected = projection(params.get('fields'))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Invalid Field')
         }
 
+    if method(event) == 'POST':
+
+        code, msg = batch(event, selected)
+
+        start = time.perf_counter()
+        body = json.dumps(msg, separators = (',', ':'))
+        METRICS.record('Serialize', start)
+
+        return {
+            'statusCode': code,
+            'body': body
+        }
+
+    if ip is not None and '/' in ip:
+
+        code, msg = ranged(ip, params, selected)
+
+        start = time.perf_counter()
+        body = dumps(msg, params)
+        METRICS.record('Serialize', start)
+
+        return {
+            'statusCode': code,
+            'body': body
+        }
+
+    try:
+
+        ipaddr = ipaddress.ip_address(ip)
+        METRICS.record('Parse', start)
+
+        code = 200
+        msg = lookup(ipaddr, selected)
+        msg['attribution'] = DESC
+        versions(msg, selected)
+
     except:
         code = 404
         msg = 'Invalid IP Address'
         pass
 
+    start = time.perf_counter()
+    body = dumps(msg, params)
+    METRICS.record('Serialize', start)
+
     return {
         'statusCode': code,
-        'body': json.dumps(msg, indent = 4)
-    }
\ No newline at end of file
+        'body': body
+    }
+
+def handler(event, context):
+
+    METRICS.reset()
+
+    if LOG_EVENTS >= 1 or (LOG_EVENTS > 0 and random.random() < LOG_EVENTS):
+        print(event)
+
+    response = respond(event)
+
+    METRICS.emit(method(event), response['statusCode'], context)
+
+    return response
+
+def prefault(path, start, length):
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        buffer = bytearray(1024 * 1024)
+        remaining = length
+        while remaining > 0:
+            count = f.readinto(buffer)
+            if count == 0:
+                break
+            remaining -= count
+
+def preload(mode):
+
+    if mode == 'none':
+        return
+
+    try:
+        regions = []
+
+        indexes = [index for index in INDEXES if INTERVALS.table(index)]
+        if len(indexes) == 0:
+            for name in DATABASES:
+                metadata = READERS.reader(name).metadata()
+                regions.append((DATABASES[name][0], 0, metadata.search_tree_size))
+
+        for name in DATABASES:
+            READERS.version(name)
+
+        if mode == 'prefault':
+            for index in indexes:
+                for key, array in INTERVALS.table(index)['arrays'].items():
+                    if key.endswith('_start') or key.endswith('_end'):
+                        array[::max(1, PAGE // array.itemsize)].tobytes()
+            for path, offset, length in regions:
+                prefault(path, offset, length)
+
+        bulk([ipaddress.ip_address(address) for address in WARMUP])
+
+    except Exception as e:
+        print('Preload Failed: '+str(e), file = sys.stderr)
+
+try:
+    import snapshot_restore_py
+except ImportError:
+    snapshot_restore_py = None
+
+if snapshot_restore_py is not None:
+
+    @snapshot_restore_py.register_after_restore
+    def restored():
+        random.seed()
+        METRICS.cold = True
+
+preload(PRELOAD)
@@ -1,183 +1,484 @@
 import boto3
+import botocore.exceptions
+import concurrent.futures
 import datetime
+import intervals
+import inverted
 import json
 import os
 import requests
+import shutil
 import tarfile
+import time
+import transfer
 import zipfile
 
-def handler(event, context):
+CHUNK = 1024 * 1024
 
-    ssm = boto3.client('ssm')
+EDITIONS = {
+    'ASN': 'asn',
+    'City': 'city'
+}
 
-    account = ssm.get_parameter(
-        Name = os.environ['SSM_PARAMETER_ACCT'], 
-        WithDecryption = True
-    )
+CODE = [
+    'search.py',
+    'reverse.py'
+]
 
-    asn = ssm.get_parameter(
-        Name = os.environ['SSM_PARAMETER_ASN'], 
-        WithDecryption = False
-    )
+DATA = [
+    'asn.updated',
+    'city.updated',
+    'geolite2.idx',
+    'reverse.idx',
+    'GeoLite2-ASN.mmdb',
+    'GeoLite2-City.mmdb'
+]
 
-    city = ssm.get_parameter(
-        Name = os.environ['SSM_PARAMETER_CITY'], 
-        WithDecryption = False
-    )
+LAYER_LIMIT = int(os.environ.get('LAYER_LIMIT_MB', '200')) * 1024 * 1024
 
-    secret = ssm.get_parameter(
-        Name = os.environ['SSM_PARAMETER_KEY'], 
-        WithDecryption = True
-    )
+MAXMIND_URL = os.environ.get('MAXMIND_URL', 'https://download.maxmind.com')
 
-    s3_client = boto3.client('s3')
+SESSION = requests.Session()
+SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections = len(EDITIONS) * 2, pool_maxsize = len(EDITIONS) * transfer.WORKERS))
+SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_connections = len(EDITIONS) * 2, pool_maxsize = len(EDITIONS) * transfer.WORKERS))
 
-    year = datetime.datetime.now().strftime('%Y')
-    month = datetime.datetime.now().strftime('%m')
-    day = datetime.datetime.now().strftime('%d')
-    hour = datetime.datetime.now().strftime('%H')
+def extract(archive, path):
 
-    url = 'https://download.maxmind.com/geoip/databases/GeoLite2-City/download?suffix=tar.gz'
-    update = requests.head(url, auth=(account['Parameter']['Value'], secret['Parameter']['Value']))
+    with open(path, 'wb') as w:
+        with tarfile.open(archive, mode = 'r|gz') as tar:
+            for member in tar:
+                if os.path.splitext(member.name)[1] == '.mmdb':
+                    r = tar.extractfile(member)
+                    if r is not None:
+                        shutil.copyfileobj(r, w, CHUNK)
+                        r.close()
 
-    print('City:', update.headers['last-modified'])
-    with open('/tmp/city.updated', 'w') as f:
-        f.write(update.headers['last-modified'])
-    f.close()
+def timing(edition, stage, start):
 
-    if city['Parameter']['Value'] != update.headers['last-modified']:
+    print('{} {} {:.3f}s'.format(edition, stage, time.perf_counter() - start))
 
-        print("Downloading GeoLite2-City.mmdb")
+def upload(s3_client, uploads):
 
-        url = 'https://download.maxmind.com/geoip/databases/GeoLite2-City/download?suffix=tar.gz'
-        response = requests.get(url, auth=(account['Parameter']['Value'], secret['Parameter']['Value']))
-        with open('/tmp/maxmind.tar.gz', 'wb') as f:
-            f.write(response.content)
-        f.close()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = len(uploads)) as executor:
+        futures = [executor.submit(s3_client.upload_file, path, bucket, key) for path, bucket, key in uploads]
+        for future in futures:
+            future.result()
 
-        with open('/tmp/GeoLite2-City.mmdb', 'wb') as w:
-            with tarfile.open('/tmp/maxmind.tar.gz', 'r:gz') as tar:
-                for member in tar.getmembers():
-                    if os.path.splitext(member.name)[1] == '.mmdb':
-                        r = tar.extractfile(member)
-                        if r is not None:
-                            content = r.read()
-                        r.close()
-                        w.write(content)
-            tar.close()
-        w.close()
-
-        response = s3_client.upload_file('/tmp/city.updated',os.environ['S3_BUCKET'],'city.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-City.mmdb',os.environ['S3_BUCKET'],'GeoLite2-City.mmdb')
-        response = s3_client.upload_file('/tmp/city.updated',os.environ['S3_ARCHIVE'],year+'/'+month+'/'+day+'/'+hour+'/city.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-City.mmdb',os.environ['S3_ARCHIVE'],year+'/'+month+'/'+day+'/'+hour+'/GeoLite2-City.mmdb')
-        response = s3_client.upload_file('/tmp/city.updated',os.environ['S3_RESEARCH'],year+'/'+month+'/'+day+'/'+hour+'/city.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-City.mmdb',os.environ['S3_RESEARCH'],year+'/'+month+'/'+day+'/'+hour+'/GeoLite2-City.mmdb')
-
-        ssm.put_parameter(
-            Name = os.environ['SSM_PARAMETER_CITY'],
-            Value = update.headers['last-modified'],
-            Type = 'String',
-            Overwrite = True
-        )
+def index(edition):
 
-    url = 'https://download.maxmind.com/geoip/databases/GeoLite2-ASN/download?suffix=tar.gz'
-    update = requests.head(url, auth=(account['Parameter']['Value'], secret['Parameter']['Value']))
+    name = EDITIONS[edition]
 
-    print('ASN:', update.headers['last-modified'])
-    with open('/tmp/asn.updated', 'w') as f:
-        f.write(update.headers['last-modified'])
-    f.close()
+    start = time.perf_counter()
+    networks, records = intervals.build('/tmp/GeoLite2-'+edition+'.mmdb', name, '/tmp/'+name+'.idx')
+    print(edition+' Index: '+str(networks)+' networks '+str(records)+' records')
+    timing(edition, 'index', start)
+
+def pipeline(edition, auth, current, etag, prefix, ssm, s3_client):
+
+    name = EDITIONS[edition]
+    started = time.perf_counter()
+
+    headers = {}
+    if current != 'EMPTY':
+        headers['If-Modified-Since'] = current
+    if etag != 'EMPTY':
+        headers['If-None-Match'] = etag
+
+    headers['Range'] = 'bytes=0-'+str(transfer.PART - 1)
+
+    url = MAXMIND_URL+'/geoip/databases/GeoLite2-'+edition+'/download?suffix='
+    archive = '/tmp/GeoLite2-'+edition+'.tar.gz'
+
+    with SESSION.get(url+'tar.gz', auth=auth, headers=headers, stream=True, timeout=transfer.TIMEOUT) as response:
 
-    if asn['Parameter']['Value'] != update.headers['last-modified']:
+        timing(edition, 'get', started)
 
-        print("Downloading GeoLite2-ASN.mmdb")
+        if response.status_code == 304:
+            modified = current
+        else:
+            response.raise_for_status()
+            modified = response.headers['last-modified']
+            etag = response.headers.get('etag', 'EMPTY')
 
-        url = 'https://download.maxmind.com/geoip/databases/GeoLite2-ASN/download?suffix=tar.gz'
-        response = requests.get(url, auth=(account['Parameter']['Value'], secret['Parameter']['Value']))
-        with open('/tmp/maxmind2.tar.gz', 'wb') as f:
-            f.write(response.content)
+        print(edition+':', modified)
+        with open('/tmp/'+name+'.updated', 'w') as f:
+            f.write(modified)
         f.close()
 
-        with open('/tmp/GeoLite2-ASN.mmdb', 'wb') as w:
-            with tarfile.open('/tmp/maxmind2.tar.gz', 'r:gz') as tar:
-                for member in tar.getmembers():
-                    if os.path.splitext(member.name)[1] == '.mmdb':
-                        r = tar.extractfile(member)
-                        if r is not None:
-                            content = r.read()
-                        r.close()
-                        w.write(content)
-            tar.close()
-        w.close()
-
-        response = s3_client.upload_file('/tmp/asn.updated',os.environ['S3_BUCKET'],'asn.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-ASN.mmdb',os.environ['S3_BUCKET'],'GeoLite2-ASN.mmdb')
-        response = s3_client.upload_file('/tmp/asn.updated',os.environ['S3_ARCHIVE'],year+'/'+month+'/'+day+'/'+hour+'/asn.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-ASN.mmdb',os.environ['S3_ARCHIVE'],year+'/'+month+'/'+day+'/'+hour+'/GeoLite2-ASN.mmdb')
-        response = s3_client.upload_file('/tmp/asn.updated',os.environ['S3_RESEARCH'],year+'/'+month+'/'+day+'/'+hour+'/asn.updated')
-        response = s3_client.upload_file('/tmp/GeoLite2-ASN.mmdb',os.environ['S3_RESEARCH'],year+'/'+month+'/'+day+'/'+hour+'/GeoLite2-ASN.mmdb')
-
-        ssm.put_parameter(
-            Name = os.environ['SSM_PARAMETER_ASN'],
-            Value = update.headers['last-modified'],
-            Type = 'String',
-            Overwrite = True
+        if current == modified:
+            timing(edition, 'total', started)
+            return False, current
+
+        print('Downloading GeoLite2-'+edition+'.tar.gz')
+
+        start = time.perf_counter()
+        parts = transfer.download(SESSION, response, auth, archive)
+        print(edition+' Download: '+str(parts)+' parts')
+        timing(edition, 'download', start)
+
+    start = time.perf_counter()
+    transfer.verify(archive, transfer.checksum(SESSION, url+'tar.gz.sha256', auth))
+    timing(edition, 'verify', start)
+
+    start = time.perf_counter()
+    extract(archive, '/tmp/GeoLite2-'+edition+'.mmdb')
+    transfer.clean(archive)
+    timing(edition, 'extract', start)
+
+    index(edition)
+
+    start = time.perf_counter()
+    upload(s3_client, [
+        ('/tmp/'+name+'.updated', os.environ['S3_BUCKET'], name+'.updated'),
+        ('/tmp/'+name+'.idx', os.environ['S3_BUCKET'], name+'.idx'),
+        ('/tmp/GeoLite2-'+edition+'.mmdb', os.environ['S3_BUCKET'], 'GeoLite2-'+edition+'.mmdb'),
+        ('/tmp/'+name+'.updated', os.environ['S3_ARCHIVE'], prefix+name+'.updated'),
+        ('/tmp/GeoLite2-'+edition+'.mmdb', os.environ['S3_ARCHIVE'], prefix+'GeoLite2-'+edition+'.mmdb'),
+        ('/tmp/'+name+'.updated', os.environ['S3_RESEARCH'], prefix+name+'.updated'),
+        ('/tmp/GeoLite2-'+edition+'.mmdb', os.environ['S3_RESEARCH'], prefix+'GeoLite2-'+edition+'.mmdb')
+    ])
+    timing(edition, 'upload', start)
+
+    ssm.put_parameter(
+        Name = os.environ['SSM_PARAMETER_'+edition.upper()],
+        Value = modified,
+        Type = 'String',
+        Overwrite = True
     )
 
-    print("Copying GeoLite2-ASN.mmdb")
+    ssm.put_parameter(
+        Name = os.environ['SSM_PARAMETER_'+edition.upper()+'_ETAG'],
+        Value = etag,
+        Type = 'String',
+        Overwrite = True
+    )
 
-    with open('/tmp/GeoLite2-ASN.mmdb', 'wb') as f:
-        s3_client.download_fileobj(os.environ['S3_BUCKET'], 'GeoLite2-ASN.mmdb', f) 
-    f.close()
+    timing(edition, 'total', started)
 
-    print("Copying GeoLite2-City.mmdb")
+    return True, modified
 
-    with open('/tmp/GeoLite2-City.mmdb', 'wb') as f:
-        s3_client.download_fileobj(os.environ['S3_BUCKET'], 'GeoLite2-City.mmdb', f) 
-    f.close()
+def fingerprint(s3_client, versions):
 
-    print("Copying search.py")
+    inputs = {
+        'code': {},
+        'data': {}
+    }
 
-    with open('/tmp/search.py', 'wb') as f:
-        s3_client.download_fileobj(os.environ['S3_BUCKET'], 'search.py', f) 
-    f.close()
+    for name in CODE:
+        code = s3_client.head_object(
+            Bucket = os.environ['S3_BUCKET'],
+            Key = name
+        )
+        inputs['code'][name] = code['ETag'].strip('"')
 
-    print("Packaging geoip2.zip")
+    for edition, name in EDITIONS.items():
+        inputs['data'][name+'.updated'] = versions[edition]
 
-    with zipfile.ZipFile('/tmp/geoip2.zip', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
+    inputs['data']['intervals'] = intervals.MAGIC.decode('utf-8')
+    inputs['data']['inverted'] = inverted.MAGIC.decode('utf-8')
+    inputs['data']['files'] = DATA
 
-        zipf.write('/tmp/asn.updated','asn.updated')
-        zipf.write('/tmp/city.updated','city.updated')
-        zipf.write('/tmp/search.py','search.py')
-        zipf.write('/tmp/GeoLite2-ASN.mmdb','GeoLite2-ASN.mmdb')
-        zipf.write('/tmp/GeoLite2-City.mmdb','GeoLite2-City.mmdb')
+    return inputs
 
-        for root, dirs, files in os.walk('/tmp/geoip2'):
-            for file in files:
-                fullpath = os.path.join(root, file)
-                zipf.write(fullpath, fullpath[5:])
+def deployed(s3_client, client):
 
-        for root, dirs, files in os.walk('/tmp/maxminddb'):
-            for file in files:
-                fullpath = os.path.join(root, file)
-                zipf.write(fullpath, fullpath[5:])
+    try:
+        response = s3_client.get_object(
+            Bucket = os.environ['S3_BUCKET'],
+            Key = 'geoip2.json'
+        )
+        state = json.loads(response['Body'].read())
+    except botocore.exceptions.ClientError:
+        return {}
+
+    config = client.get_function_configuration(
+        FunctionName = os.environ['LAMBDA_FUNCTION']
+    )
+
+    if state.get('sha256') != config['CodeSha256']:
+        state['code'] = {}
+
+    if state.get('layer') not in [layer['Arn'] for layer in config.get('Layers', [])]:
+        state['data'] = {}
+
+    return state
+
+def package(path, files, compression):
 
+    with zipfile.ZipFile(path, 'w', compression = compression) as zipf:
+        for name in files:
+            zipf.write('/tmp/'+name, name)
     zipf.close()
 
-    response = s3_client.upload_file('/tmp/geoip2.zip',os.environ['S3_BUCKET'],'geoip2.zip')
+def merged():
 
-    client = boto3.client('lambda')
+    start = time.perf_counter()
+
+    if os.path.exists('/tmp/geolite2.idx'):
+        os.remove('/tmp/geolite2.idx')
+
+    segments = intervals.merge({'city': '/tmp/city.idx', 'asn': '/tmp/asn.idx'}, '/tmp/geolite2.idx')
+    print('Merged Index: '+str(segments)+' segments')
+
+    timing('geolite2.idx', 'merge', start)
+
+def inverse():
+
+    start = time.perf_counter()
+
+    if os.path.exists('/tmp/reverse.idx'):
+        os.remove('/tmp/reverse.idx')
+
+    if os.path.exists('/tmp/geolite2.idx'):
+        keys = inverted.build('/tmp/geolite2.idx', '/tmp/reverse.idx')
+        print('Reverse Index: '+str(keys)+' keys')
+
+    timing('reverse.idx', 'invert', start)
+
+def publish(s3_client, client, data):
+
+    merged()
+    inverse()
+
+    files = [name for name in DATA if os.path.exists('/tmp/'+name)]
+    size = sum(os.path.getsize('/tmp/'+name) for name in files)
+    print('Layer Size: '+str(size)+' bytes')
+
+    if size > LAYER_LIMIT:
+        raise RuntimeError('Layer '+str(size)+' bytes exceeds LAYER_LIMIT_MB '+str(LAYER_LIMIT // (1024 * 1024)))
+
+    start = time.perf_counter()
+    package('/tmp/geolite2.zip', files, zipfile.ZIP_STORED)
+    timing('geolite2.zip', 'package', start)
+
+    start = time.perf_counter()
+    s3_client.upload_file('/tmp/geolite2.zip', os.environ['S3_BUCKET'], 'geolite2.zip')
+    os.remove('/tmp/geolite2.zip')
+    timing('geolite2.zip', 'upload', start)
+
+    print("Publishing "+os.environ['LAMBDA_LAYER'])
+
+    start = time.perf_counter()
+
+    layer = client.publish_layer_version(
+        LayerName = os.environ['LAMBDA_LAYER'],
+        Description = 'GeoLite2-ASN '+data['asn.updated']+' GeoLite2-City '+data['city.updated'],
+        Content = {
+            'S3Bucket': os.environ['S3_BUCKET'],
+            'S3Key': 'geolite2.zip'
+        },
+        CompatibleRuntimes = [
+            'python3.13'
+        ],
+        CompatibleArchitectures = [
+            'arm64'
+        ]
+    )
+
+    config = client.get_function_configuration(
+        FunctionName = os.environ['LAMBDA_FUNCTION']
+    )
+
+    layers = []
+    keep = layer['Version']
+    for attached in config.get('Layers', []):
+        if attached['Arn'].rsplit(':', 1)[0] != layer['LayerArn']:
+            layers.append(attached['Arn'])
+        else:
+            keep = min(keep, int(attached['Arn'].rsplit(':', 1)[1]))
+    layers.append(layer['LayerVersionArn'])
+
+    client.get_waiter('function_updated').wait(
+        FunctionName = os.environ['LAMBDA_FUNCTION']
+    )
+
+    response = client.update_function_configuration(
+        FunctionName = os.environ['LAMBDA_FUNCTION'],
+        Layers = layers
+    )
+
+    timing(os.environ['LAMBDA_LAYER'], 'publish', start)
+
+    prune(client, keep)
+
+    return layer['LayerVersionArn'], response['CodeSha256']
+
+def prune(client, keep):
+
+    start = time.perf_counter()
+
+    versions = []
+    marker = None
+    while True:
+        if marker is None:
+            response = client.list_layer_versions(LayerName = os.environ['LAMBDA_LAYER'])
+        else:
+            response = client.list_layer_versions(LayerName = os.environ['LAMBDA_LAYER'], Marker = marker)
+        versions.extend([item['Version'] for item in response.get('LayerVersions', []) if item['Version'] < keep])
+        marker = response.get('NextMarker')
+        if marker is None:
+            break
+
+    for version in versions:
+        client.delete_layer_version(
+            LayerName = os.environ['LAMBDA_LAYER'],
+            VersionNumber = version
+        )
+
+    print('Pruned '+os.environ['LAMBDA_LAYER']+': '+str(len(versions))+' versions older than '+str(keep))
+    timing(os.environ['LAMBDA_LAYER'], 'prune', start)
+
+def deploy(s3_client, client):
+
+    start = time.perf_counter()
+    package('/tmp/search.zip', CODE, zipfile.ZIP_DEFLATED)
+    s3_client.upload_file('/tmp/search.zip', os.environ['S3_BUCKET'], 'search.zip')
+    timing('search.zip', 'package', start)
 
     print("Updating "+os.environ['LAMBDA_FUNCTION'])
 
+    start = time.perf_counter()
+
+    client.get_waiter('function_updated').wait(
+        FunctionName = os.environ['LAMBDA_FUNCTION']
+    )
+
     response = client.update_function_code(
         FunctionName = os.environ['LAMBDA_FUNCTION'],
         S3Bucket = os.environ['S3_BUCKET'],
-        S3Key = 'geoip2.zip'
+        S3Key = 'search.zip'
+    )
+
+    timing(os.environ['LAMBDA_FUNCTION'], 'update', start)
+
+    return response['CodeSha256']
+
+def copy(s3_client, key):
+
+    start = time.perf_counter()
+
+    with open('/tmp/'+key, 'wb') as f:
+        s3_client.download_fileobj(os.environ['S3_BUCKET'], key, f)
+    f.close()
+
+    timing(key, 'copy', start)
+
+def restore(s3_client, edition):
+
+    copy(s3_client, 'GeoLite2-'+edition+'.mmdb')
+
+    try:
+        copy(s3_client, EDITIONS[edition]+'.idx')
+        rebuild = not intervals.current('/tmp/'+EDITIONS[edition]+'.idx')
+    except botocore.exceptions.ClientError:
+        rebuild = True
+
+    if rebuild:
+        index(edition)
+        s3_client.upload_file('/tmp/'+EDITIONS[edition]+'.idx', os.environ['S3_BUCKET'], EDITIONS[edition]+'.idx')
+
+def handler(event, context):
+
+    started = time.perf_counter()
+
+    ssm = boto3.client('ssm')
+
+    parameters = ssm.get_parameters(
+        Names = [
+            os.environ['SSM_PARAMETER_ACCT'],
+            os.environ['SSM_PARAMETER_ASN'],
+            os.environ['SSM_PARAMETER_ASN_ETAG'],
+            os.environ['SSM_PARAMETER_CITY'],
+            os.environ['SSM_PARAMETER_CITY_ETAG'],
+            os.environ['SSM_PARAMETER_KEY']
+        ],
+        WithDecryption = True
     )
 
+    values = {}
+    for parameter in parameters['Parameters']:
+        values[parameter['Name']] = parameter['Value']
+
+    auth = (values[os.environ['SSM_PARAMETER_ACCT']], values[os.environ['SSM_PARAMETER_KEY']])
+
+    s3_client = boto3.client('s3')
+
+    now = datetime.datetime.now()
+    prefix = now.strftime('%Y')+'/'+now.strftime('%m')+'/'+now.strftime('%d')+'/'+now.strftime('%H')+'/'
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = len(EDITIONS)) as executor:
+        futures = {}
+        for edition in EDITIONS:
+            current = values[os.environ['SSM_PARAMETER_'+edition.upper()]]
+            etag = values[os.environ['SSM_PARAMETER_'+edition.upper()+'_ETAG']]
+            futures[edition] = executor.submit(pipeline, edition, auth, current, etag, prefix, ssm, s3_client)
+        results = {edition: future.result() for edition, future in futures.items()}
+
+    updated = {edition: result[0] for edition, result in results.items()}
+    versions = {edition: result[1] for edition, result in results.items()}
+
+    client = boto3.client('lambda')
+
+    start = time.perf_counter()
+
+    inputs = fingerprint(s3_client, versions)
+    state = deployed(s3_client, client)
+
+    code = inputs['code'] != state.get('code')
+    data = inputs['data'] != state.get('data')
+
+    timing('Fingerprint', 'total', start)
+
+    if not code and not data:
+        print('No Changes')
+        timing('Refresh', 'total', started)
+        return {
+            'statusCode': 200,
+            'body': json.dumps('This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.')
+        }
+
+    start = time.perf_counter()
+
+    tasks = []
+    if code:
+        for name in CODE:
+            tasks.append((copy, name))
+    if data:
+        for edition in EDITIONS:
+            if not updated[edition]:
+                tasks.append((restore, edition))
+
+    if len(tasks) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = len(tasks)) as executor:
+            futures = [executor.submit(task, s3_client, arg) for task, arg in tasks]
+            for future in futures:
+                future.result()
+
+    timing('Copying', 'total', start)
+
+    if data:
+        layer, sha256 = publish(s3_client, client, inputs['data'])
+    else:
+        layer = state['layer']
+        sha256 = state['sha256']
+
+    if code:
+        sha256 = deploy(s3_client, client)
+
+    s3_client.put_object(
+        Bucket = os.environ['S3_BUCKET'],
+        Key = 'geoip2.json',
+        Body = json.dumps({
+            'code': inputs['code'],
+            'data': inputs['data'],
+            'layer': layer,
+            'sha256': sha256
+        }).encode('utf-8')
+    )
+
+    timing('Refresh', 'total', started)
+
     return {
         'statusCode': 200,
         'body': json.dumps('This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.')
-    }
\ No newline at end of file
+    }
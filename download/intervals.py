@@ -0,0 +1,301 @@
+import array
+import ipaddress
+import json
+import maxminddb
+import struct
+
+MAGIC = b'GEOIDX02'
+
+ALIGN = 16
+
+ALIASES = [
+    ('::/96', 96),
+    ('::ffff:0:0/96', 96),
+    ('2001::/32', 32),
+    ('2002::/16', 16)
+]
+
+SAMPLES = 16
+
+NONE = 0xFFFFFFFF
+
+SIZES = {
+    '<u1': 1,
+    '<u4': 4,
+    '<u8': 8,
+    'S16': 16
+}
+
+TYPECODES = {
+    '<u1': 'B',
+    '<u4': 'I',
+    '<u8': 'Q'
+}
+
+def asn(record):
+
+    return {
+        'id': record.get('autonomous_system_number'),
+        'org': record.get('autonomous_system_organization')
+    }
+
+def city(record):
+
+    country = record.get('country', {})
+    subdivisions = record.get('subdivisions') or [{}]
+    location = record.get('location', {})
+
+    return {
+        'country': country.get('names', {}).get('en'),
+        'c_iso': country.get('iso_code'),
+        'state': subdivisions[-1].get('names', {}).get('en'),
+        's_iso': subdivisions[-1].get('iso_code'),
+        'city': record.get('city', {}).get('names', {}).get('en'),
+        'zip': record.get('postal', {}).get('code'),
+        'latitude': location.get('latitude'),
+        'longitude': location.get('longitude')
+    }
+
+FIELDS = {
+    'asn': asn,
+    'city': city
+}
+
+def aliased(reader, network, offset, samples):
+
+    if len(samples) == 0:
+        return False
+
+    base = int(ipaddress.ip_network(network).network_address)
+
+    for sample, record in samples:
+        address = ipaddress.IPv6Address(base | (int(sample.network_address) << (128 - offset - 32)))
+        if reader.get_with_prefix_len(address) != (record, offset + sample.prefixlen):
+            return False
+
+    return True
+
+class Table:
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.starts = {4: array.array('I'), 6: bytearray()}
+        self.ends = {4: array.array('I'), 6: bytearray()}
+        self.records = {(version, source): array.array('I') for version in (4, 6) for source in sources}
+        self.prefixes = {(version, source): array.array('B') for version in (4, 6) for source in sources}
+
+    def append(self, version, start, end, entries):
+        if version == 4:
+            self.starts[4].append(start)
+            self.ends[4].append(end)
+        else:
+            self.starts[6] += start.to_bytes(16, 'big')
+            self.ends[6] += end.to_bytes(16, 'big')
+        for source in self.sources:
+            rid, prefixlen = entries.get(source, (NONE, 0))
+            self.records[(version, source)].append(rid)
+            self.prefixes[(version, source)].append(prefixlen)
+
+    def count(self):
+        return len(self.starts[4]) + len(self.starts[6]) // 16
+
+    def arrays(self, tables):
+        arrays = [
+            ('v4_start', '<u4', self.starts[4].tobytes()),
+            ('v4_end', '<u4', self.ends[4].tobytes()),
+            ('v6_start', 'S16', bytes(self.starts[6])),
+            ('v6_end', 'S16', bytes(self.ends[6]))
+        ]
+        for source in self.sources:
+            for version in (4, 6):
+                arrays.append(('v'+str(version)+'_'+source+'_record', '<u4', self.records[(version, source)].tobytes()))
+                arrays.append(('v'+str(version)+'_'+source+'_prefix', '<u1', self.prefixes[(version, source)].tobytes()))
+            offsets, records = tables[source]
+            arrays.append((source+'_offset', '<u8', offsets))
+            arrays.append((source+'_records', '<u1', records))
+        return arrays
+
+def write(path, header, arrays, magic = MAGIC):
+
+    layout = {}
+    position = 0
+    for key, dtype, data in arrays:
+        layout[key] = [dtype, position, len(data) // SIZES[dtype]]
+        position += len(data) + (-len(data) % ALIGN)
+
+    header['arrays'] = layout
+    encoded = json.dumps(header, separators = (',', ':')).encode('utf-8')
+    start = len(magic) + 8 + len(encoded)
+    start += -start % ALIGN
+
+    with open(path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', start))
+        f.write(encoded)
+        f.write(b'\x00' * (start - f.tell()))
+        for key, dtype, data in arrays:
+            f.write(data)
+            f.write(b'\x00' * (-len(data) % ALIGN))
+    f.close()
+
+def current(path):
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    f.close()
+
+    return magic == MAGIC
+
+def read(path):
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:len(MAGIC)] != MAGIC:
+        return None, None
+
+    start = struct.unpack('<Q', data[len(MAGIC):len(MAGIC) + 8])[0]
+    header = json.loads(data[len(MAGIC) + 8:start].rstrip(b'\x00'))
+
+    arrays = {}
+    view = memoryview(data)
+    for key, (dtype, offset, count) in header['arrays'].items():
+        chunk = view[start + offset:start + offset + count * SIZES[dtype]]
+        if dtype == 'S16':
+            arrays[key] = chunk
+        else:
+            arrays[key] = chunk.cast(TYPECODES[dtype])
+
+    return header, arrays
+
+def build(path, name, out):
+
+    ids = {}
+    records = bytearray()
+    offsets = array.array('Q', [0])
+
+    table = Table([name])
+    samples = []
+
+    with maxminddb.open_database(path) as reader:
+
+        for network, record in reader:
+
+            fields = FIELDS[name](record)
+            key = tuple(fields.values())
+            rid = ids.get(key)
+            if rid is None:
+                rid = len(ids)
+                ids[key] = rid
+                records += json.dumps(fields, separators = (',', ':')).encode('utf-8')
+                offsets.append(len(records))
+
+            table.append(network.version, int(network.network_address), int(network.broadcast_address), {name: (rid, network.prefixlen)})
+
+            if network.version == 4 and len(samples) < SAMPLES:
+                samples.append((network, record))
+
+        version = reader.metadata().ip_version
+
+        aliases = []
+        if version == 6:
+            aliases = [[network, offset] for network, offset in ALIASES if aliased(reader, network, offset, samples)]
+
+    header = {
+        'ip_version': version,
+        'aliases': aliases,
+        'sources': {
+            name: list(FIELDS[name]({}).keys())
+        }
+    }
+
+    write(out, header, table.arrays({name: (offsets.tobytes(), bytes(records))}))
+
+    return table.count(), len(ids)
+
+def entries(arrays, name, version):
+
+    starts = arrays['v'+str(version)+'_start']
+    ends = arrays['v'+str(version)+'_end']
+    rids = arrays['v'+str(version)+'_'+name+'_record']
+    prefixes = arrays['v'+str(version)+'_'+name+'_prefix']
+
+    for position in range(len(rids)):
+        if rids[position] == NONE:
+            continue
+        if version == 4:
+            yield starts[position], ends[position], rids[position], prefixes[position]
+        else:
+            yield int.from_bytes(starts[position * 16:position * 16 + 16], 'big'), int.from_bytes(ends[position * 16:position * 16 + 16], 'big'), rids[position], prefixes[position]
+
+def sweep(first, second):
+
+    last = object()
+    a = next(first, last)
+    b = next(second, last)
+    position = 0
+
+    while a is not last or b is not last:
+
+        if a is not last and a[1] < position:
+            a = next(first, last)
+            continue
+        if b is not last and b[1] < position:
+            b = next(second, last)
+            continue
+
+        starts = [max(entry[0], position) for entry in (a, b) if entry is not last]
+        start = min(starts)
+
+        ends = []
+        inside = []
+        for entry in (a, b):
+            if entry is last:
+                inside.append(None)
+            elif max(entry[0], position) == start:
+                inside.append(entry)
+                ends.append(entry[1])
+            else:
+                inside.append(None)
+                ends.append(entry[0] - 1)
+
+        end = min(ends)
+        yield start, end, inside[0], inside[1]
+        position = end + 1
+
+def merge(paths, out):
+
+    names = list(paths)
+    sources = {}
+    for name in names:
+        sources[name] = read(paths[name])
+        if sources[name][0] is None:
+            return None
+
+    headers = [sources[name][0] for name in names]
+    if any(header['ip_version'] != headers[0]['ip_version'] or header['aliases'] != headers[0]['aliases'] for header in headers):
+        print('Merged Index: alias layout differs, skipping')
+        return None
+
+    table = Table(names)
+
+    for version in (4, 6):
+        first = entries(sources[names[0]][1], names[0], version)
+        second = entries(sources[names[1]][1], names[1], version)
+        for start, end, a, b in sweep(first, second):
+            found = {}
+            if a is not None:
+                found[names[0]] = (a[2], a[3])
+            if b is not None:
+                found[names[1]] = (b[2], b[3])
+            table.append(version, start, end, found)
+
+    header = {
+        'ip_version': headers[0]['ip_version'],
+        'aliases': headers[0]['aliases'],
+        'sources': {name: sources[name][0]['sources'][name] for name in names}
+    }
+
+    write(out, header, table.arrays({name: (sources[name][1][name+'_offset'].tobytes(), sources[name][1][name+'_records'].tobytes()) for name in names}))
+
+    return table.count()
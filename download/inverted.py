@@ -0,0 +1,107 @@
+import array
+import intervals
+import json
+
+MAGIC = b'GEOREV02'
+
+KINDS = {
+    'asn': 'asn',
+    'org': 'asn',
+    'country': 'city',
+    'subdivision': 'city'
+}
+
+def labels(name, fields):
+
+    found = {}
+
+    if name == 'asn':
+        if fields.get('id') is not None:
+            found['asn'] = str(fields['id'])
+    else:
+        if fields.get('c_iso') is not None:
+            found['country'] = fields['c_iso'].upper()
+            if fields.get('s_iso') is not None:
+                found['subdivision'] = fields['c_iso'].upper()+'-'+fields['s_iso'].upper()
+
+    return found
+
+def records(arrays, name):
+
+    offsets = arrays[name+'_offset']
+    data = arrays[name+'_records']
+
+    for rid in range(len(offsets) - 1):
+        yield json.loads(bytes(data[offsets[rid]:offsets[rid + 1]]))
+
+def postings(arrays, name, tables):
+
+    keyed = [labels(name, fields) for fields in records(arrays, name)]
+
+    row = 0
+    for version in (4, 6):
+        bits = 32 if version == 4 else 128
+        starts = arrays['v'+str(version)+'_start']
+        rids = arrays['v'+str(version)+'_'+name+'_record']
+        prefixes = arrays['v'+str(version)+'_'+name+'_prefix']
+        for position in range(len(rids)):
+            rid = rids[position]
+            if rid != intervals.NONE:
+                if version == 4:
+                    start = starts[position]
+                else:
+                    start = int.from_bytes(starts[position * 16:position * 16 + 16], 'big')
+                shift = bits - prefixes[position]
+                if start >> shift << shift == start:
+                    for kind, key in keyed[rid].items():
+                        tables[kind].setdefault(key, []).append(row)
+            row += 1
+
+    if name == 'asn':
+        for fields in records(arrays, name):
+            if fields.get('id') is not None and fields.get('org') is not None:
+                tables['org'].setdefault(fields['org'].casefold(), set()).add(fields['id'])
+
+def pack(kind, table):
+
+    keys = bytearray()
+    key_offsets = array.array('Q', [0])
+    posting_offsets = array.array('Q', [0])
+    values = array.array('I')
+
+    for key in sorted(table, key = lambda key: key.encode('utf-8')):
+        keys += key.encode('utf-8')
+        key_offsets.append(len(keys))
+        values.extend(sorted(table[key]))
+        posting_offsets.append(len(values))
+
+    return [
+        (kind+'_keys', '<u1', bytes(keys)),
+        (kind+'_key_offset', '<u8', key_offsets.tobytes()),
+        (kind+'_posting_offset', '<u8', posting_offsets.tobytes()),
+        (kind+'_postings', '<u4', values.tobytes())
+    ]
+
+def build(path, out):
+
+    tables = {kind: {} for kind in KINDS}
+
+    header, arrays = intervals.read(path)
+    if header is None:
+        return None
+
+    for name in header['sources']:
+        postings(arrays, name, tables)
+
+    header = {
+        'kinds': KINDS,
+        'rows': [len(arrays['v4_start']), len(arrays['v6_start']) // 16]
+    }
+
+    arrays = []
+    for kind in KINDS:
+        arrays.extend(pack(kind, tables[kind]))
+
+    intervals.write(out, header, arrays, MAGIC)
+
+    return {kind: len(tables[kind]) for kind in KINDS}
@@ -0,0 +1,282 @@
+import boto3
+import botocore.exceptions
+import collections
+import concurrent.futures
+import datetime
+import gzip
+import intervals
+import json
+import maxminddb
+import os
+import urllib.parse
+
+RETENTION = int(os.environ.get('TIMELINE_DAYS', '14'))
+
+BACKFILL = int(os.environ.get('TIMELINE_BACKFILL', '2'))
+
+WORKERS = 16
+
+BITS = [12, 24]
+
+EDITIONS = [
+    'ASN',
+    'City'
+]
+
+def shards(network):
+
+    bits = BITS[0] if network.version == 4 else BITS[1]
+
+    start = int(network.network_address) >> (network.max_prefixlen - bits)
+    count = 1 << max(0, bits - network.prefixlen)
+
+    return ['v'+str(network.version)+'/'+format(start + i, 'x') for i in range(count)]
+
+def groups(reader, name):
+
+    key = None
+    networks = []
+
+    for network, record in reader:
+        fields = intervals.FIELDS[name](record)
+        for shard in shards(network):
+            if shard != key:
+                if key is not None:
+                    yield key, networks
+                key = shard
+                networks = []
+            networks.append((network, fields))
+
+    if key is not None:
+        yield key, networks
+
+def load(s3_client, bucket, key):
+
+    try:
+        response = s3_client.get_object(
+            Bucket = bucket,
+            Key = key
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+    body = response['Body'].read()
+    if key.endswith('.gz'):
+        body = gzip.decompress(body)
+
+    return json.loads(body)
+
+def merge(shard, networks, releases):
+
+    release = releases[-1]['prefix']
+    previous = releases[-2]['prefix'] if len(releases) > 1 else None
+    oldest = releases[0]['prefix']
+
+    records = []
+    ids = {}
+
+    def rid(fields):
+        key = json.dumps(fields, sort_keys = True)
+        if key not in ids:
+            ids[key] = len(records)
+            records.append(fields)
+        return ids[key]
+
+    entries = {}
+
+    if shard is not None:
+        for net, start, end, spans in shard['networks']:
+            kept = []
+            for record, first, last in spans:
+                if previous is None:
+                    continue
+                if last > previous:
+                    last = previous
+                if last >= oldest and first <= last:
+                    kept.append([rid(shard['records'][record]), first, last])
+            if len(kept) > 0:
+                entries[net] = [start, end, kept]
+
+    for network, fields in networks:
+        net = str(network)
+        record = rid(fields)
+        entry = entries.get(net)
+        if entry is None:
+            entries[net] = [int(network.network_address), int(network.broadcast_address), [[record, release, release]]]
+        elif entry[2][-1][0] == record and entry[2][-1][2] == previous:
+            entry[2][-1][2] = release
+        else:
+            entry[2].append([record, release, release])
+
+    if len(entries) == 0:
+        return None
+
+    return {
+        'releases': releases,
+        'records': records,
+        'networks': sorted([[net] + entry for net, entry in entries.items()], key = lambda entry: entry[1])
+    }
+
+def write(s3_client, bucket, name, key, networks, releases, existing):
+
+    path = 'timeline/'+name+'/'+key+'.json.gz'
+    shard = load(s3_client, bucket, path) if existing else None
+    shard = merge(shard, networks, releases)
+
+    if shard is None:
+        if existing:
+            s3_client.delete_object(
+                Bucket = bucket,
+                Key = path
+            )
+        return key, False
+
+    s3_client.put_object(
+        Bucket = bucket,
+        Key = path,
+        Body = gzip.compress(json.dumps(shard, separators = (',', ':')).encode('utf-8'))
+    )
+
+    return key, True
+
+def aliases(reader):
+
+    if reader.metadata().ip_version != 6:
+        return []
+
+    samples = []
+    for network, record in reader:
+        if network.version != 4 or len(samples) >= intervals.SAMPLES:
+            break
+        samples.append((network, record))
+
+    return [[network, offset] for network, offset in intervals.ALIASES if intervals.aliased(reader, network, offset, samples)]
+
+def apply(s3_client, bucket, name, manifest, path, prefix, updated, pending):
+
+    release = prefix.rstrip('/')
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days = RETENTION)).strftime('%Y/%m/%d/%H')
+
+    releases = [item for item in manifest['releases'] if item['prefix'] < release and item['prefix'] >= cutoff]
+    releases.append({'prefix': release, 'updated': updated})
+
+    existing = set(manifest['shards'])
+    seen = set()
+    written = []
+
+    with maxminddb.open_database(path) as reader:
+        aliased = aliases(reader)
+        with concurrent.futures.ThreadPoolExecutor(max_workers = WORKERS) as executor:
+            futures = collections.deque()
+            for key, networks in groups(reader, name):
+                seen.add(key)
+                futures.append(executor.submit(write, s3_client, bucket, name, key, networks, releases, key in existing))
+                while len(futures) > WORKERS * 2:
+                    written.append(futures.popleft().result())
+            for key in existing - seen:
+                futures.append(executor.submit(write, s3_client, bucket, name, key, [], releases, True))
+            while len(futures) > 0:
+                written.append(futures.popleft().result())
+
+    manifest = {
+        'releases': releases,
+        'shards': sorted([key for key, exists in written if exists]),
+        'aliases': aliased,
+        'pending': pending,
+        'bits': BITS
+    }
+
+    s3_client.put_object(
+        Bucket = bucket,
+        Key = 'timeline/'+name+'/index.json',
+        Body = json.dumps(manifest).encode('utf-8')
+    )
+
+    return manifest
+
+def archived(s3_client, bucket, edition):
+
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days = RETENTION)).strftime('%Y/%m/%d/%H')
+    prefixes = []
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket = bucket):
+        for item in page.get('Contents', []):
+            parts = item['Key'].split('/')
+            if len(parts) == 5 and parts[4] == 'GeoLite2-'+edition+'.mmdb':
+                prefix = '/'.join(parts[:4])
+                if prefix >= cutoff:
+                    prefixes.append(prefix)
+
+    return sorted(prefixes)
+
+def update(s3_client, bucket, edition, releases = ()):
+
+    name = edition.lower()
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days = RETENTION)).strftime('%Y/%m/%d/%H')
+    manifest = load(s3_client, bucket, 'timeline/'+name+'/index.json')
+
+    if manifest is None or 'pending' not in manifest or manifest.get('bits') != BITS:
+        shards = manifest['shards'] if manifest is not None else []
+        manifest = {'releases': [], 'shards': shards, 'pending': archived(s3_client, bucket, edition), 'bits': BITS}
+
+    latest = manifest['releases'][-1]['prefix'] if len(manifest['releases']) > 0 else ''
+    queued = manifest['pending'] + list(releases)
+    pending = sorted(set([prefix for prefix in queued if prefix >= cutoff and prefix > latest]))
+
+    done = 0
+
+    for archive in pending[:BACKFILL]:
+
+        try:
+            response = s3_client.get_object(
+                Bucket = bucket,
+                Key = archive+'/'+name+'.updated'
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                print('Timeline '+edition+' waiting for '+archive+'/'+name+'.updated')
+                break
+            raise
+
+        print('Timeline '+edition+' '+archive)
+        s3_client.download_file(bucket, archive+'/GeoLite2-'+edition+'.mmdb', '/tmp/timeline-'+name+'.mmdb')
+        manifest = apply(s3_client, bucket, name, manifest, '/tmp/timeline-'+name+'.mmdb', archive+'/', response['Body'].read().decode('utf-8'), pending[done + 1:])
+        os.remove('/tmp/timeline-'+name+'.mmdb')
+        done += 1
+
+    if manifest['pending'] != pending[done:]:
+        manifest['pending'] = pending[done:]
+        s3_client.put_object(
+            Bucket = bucket,
+            Key = 'timeline/'+name+'/index.json',
+            Body = json.dumps(manifest).encode('utf-8')
+        )
+
+    print('Timeline '+edition+': '+str(len(manifest['releases']))+' releases, '+str(len(manifest['pending']))+' pending')
+
+    return manifest
+
+def handler(event, context):
+
+    s3_client = boto3.client('s3')
+    bucket = os.environ['S3_ARCHIVE']
+
+    releases = {}
+    for record in event.get('Records', []):
+        parts = urllib.parse.unquote_plus(record['s3']['object']['key']).split('/')
+        for edition in EDITIONS:
+            if len(parts) == 5 and parts[4] == 'GeoLite2-'+edition+'.mmdb':
+                releases.setdefault(edition, []).append('/'.join(parts[:4]))
+
+    pending = {}
+    for edition in EDITIONS:
+        manifest = update(s3_client, bucket, edition, releases.get(edition, []))
+        pending[edition] = manifest['pending']
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(pending)
+    }
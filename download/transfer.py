@@ -0,0 +1,175 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import requests
+import threading
+import time
+import urllib3.exceptions
+
+CHUNK = 64 * 1024
+
+PART = int(os.environ.get('DOWNLOAD_PART', str(8 * 1024 * 1024)))
+
+WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '4'))
+
+RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', '3'))
+
+TIMEOUT = (10, int(os.environ.get('DOWNLOAD_TIMEOUT', '60')))
+
+class Incomplete(Exception):
+    pass
+
+class Mismatch(Exception):
+    pass
+
+def plan(length, size):
+
+    return [(start, min(start + size, length) - 1) for start in range(0, length, size)]
+
+def total(response):
+
+    return int(response.headers['content-range'].rsplit('/', 1)[1])
+
+class Progress:
+
+    def __init__(self, path, length, validator):
+        self.path = path+'.parts'
+        self.lock = threading.Lock()
+        self.state = {'length': length, 'validator': validator, 'done': []}
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+            if state['length'] == length and state['validator'] == validator:
+                self.state = state
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def done(self):
+        return set(self.state['done'])
+
+    def mark(self, part):
+        with self.lock:
+            self.state['done'].append(part)
+            with open(self.path+'.tmp', 'w') as f:
+                json.dump(self.state, f)
+            os.replace(self.path+'.tmp', self.path)
+
+def fetch(session, url, auth, validator, fd, first, last, response = None):
+
+    position = first
+
+    for attempt in range(RETRIES + 1):
+
+        try:
+            if response is None:
+                response = session.get(
+                    url,
+                    auth = auth,
+                    headers = {
+                        'Range': 'bytes='+str(position)+'-'+str(last),
+                        'If-Range': validator
+                    },
+                    stream = True,
+                    timeout = TIMEOUT
+                )
+            with response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise Mismatch('Range '+str(position)+'-'+str(last)+' returned '+str(response.status_code))
+                for chunk in response.raw.stream(CHUNK, decode_content = False):
+                    os.pwrite(fd, chunk, position)
+                    position += len(chunk)
+            if position != last + 1:
+                raise Incomplete('Received '+str(position - first)+' of '+str(last + 1 - first)+' bytes')
+            return
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, urllib3.exceptions.HTTPError, Incomplete) as e:
+            if attempt == RETRIES:
+                raise
+            print('Range '+str(first)+'-'+str(last)+' resuming at '+str(position)+': '+str(e))
+            response = None
+            time.sleep(2 ** attempt)
+
+def stream(response, path):
+
+    with open(path, 'wb') as f:
+        for chunk in response.raw.stream(CHUNK, decode_content = False):
+            f.write(chunk)
+    f.close()
+
+def download(session, response, auth, path):
+
+    if response.status_code != 206:
+        stream(response, path)
+        return 1
+
+    length = total(response)
+    validator = response.headers.get('etag') or response.headers.get('last-modified')
+    url = response.url
+
+    if len(response.history) > 0:
+        auth = None
+
+    parts = plan(length, PART)
+    progress = Progress(path, length, validator)
+    done = progress.done()
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+
+    try:
+        os.ftruncate(fd, length)
+
+        if 0 in done:
+            response.close()
+        else:
+            fetch(session, url, auth, validator, fd, parts[0][0], parts[0][1], response)
+            progress.mark(0)
+
+        pending = [part for part in range(1, len(parts)) if part not in done]
+
+        def worker(part):
+            fetch(session, url, auth, validator, fd, parts[part][0], parts[part][1])
+            progress.mark(part)
+
+        if len(pending) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = WORKERS) as executor:
+                futures = [executor.submit(worker, part) for part in pending]
+                concurrent.futures.wait(futures)
+            for future in futures:
+                future.result()
+
+    finally:
+        os.close(fd)
+
+    return len(parts) - len(done)
+
+def checksum(session, url, auth):
+
+    with session.get(url, auth = auth, timeout = TIMEOUT) as response:
+        response.raise_for_status()
+        return response.text.split()[0].lower()
+
+def digest(path):
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            sha256.update(chunk)
+    f.close()
+
+    return sha256.hexdigest()
+
+def verify(path, expected):
+
+    actual = digest(path)
+
+    if actual != expected:
+        clean(path)
+        raise Mismatch('SHA-256 '+actual+' does not match published '+expected)
+
+def clean(path):
+
+    for name in (path, path+'.parts'):
+        if os.path.exists(name):
+            os.remove(name)
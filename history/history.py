@@ -1,119 +1,660 @@
-import geoip2.database
+import base64
+import bisect
 import boto3
+import botocore.exceptions
+import concurrent.futures
+import datetime
+import gzip
+import hashlib
 import ipaddress
 import json
+import maxminddb
+import os
+import re
+import remote
+import shutil
+import threading
+import urllib.parse
+
+ARCHIVE = 'maxmindgeolite2archive'
+
+CACHE_BYTES = int(os.environ.get('CACHE_BYTES', str(448 * 1024 * 1024)))
+
+BACKEND = os.environ.get('SNAPSHOT_BACKEND', 'range')
+
+LISTERS = int(os.environ.get('LIST_WORKERS', '16'))
+
+WORKERS = int(os.environ.get('SNAPSHOT_WORKERS', '16'))
+
+BATCH_LIMIT = int(os.environ.get('BATCH_LIMIT', '100'))
+
+RETENTION = int(os.environ.get('TIMELINE_DAYS', '14'))
+
+BITS = [12, 24]
+
+DESC = 'This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.'
+
+HOURLY = 48
+
+HOUR = '%Y/%m/%d/%H'
+
+RELATIVE = re.compile(r'(\d+)([hd])')
+
+ALIASES = [
+    ('::/96', 96),
+    ('::ffff:0:0/96', 96),
+    ('2001::/32', 32),
+    ('2002::/16', 16)
+]
+
+GRANULARITIES = {
+    'hourly': 13,
+    'daily': 10,
+    'monthly': 7
+}
+
+EMPTY = {
+    'asn': {
+        'id': None,
+        'org': None
+    },
+    'city': {
+        'country': None,
+        'c_iso': None,
+        'state': None,
+        's_iso': None,
+        'city': None,
+        'zip': None,
+        'latitude': None,
+        'longitude': None
+    }
+}
+
+class SnapshotCache:
+
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+        self.downloaded = 0
+
+    def local(self, key, etag):
+        digest = hashlib.sha256((key+'@'+etag).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest+os.path.splitext(key)[1])
+
+    def evict(self, incoming):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total + incoming <= self.limit and shutil.disk_usage(self.path).free > incoming:
+                break
+            if path in self.pinned or path.endswith('.part'):
+                continue
+            os.remove(path)
+            total -= size
+
+    def get(self, s3, key, etag, size):
+        os.makedirs(self.path, exist_ok = True)
+        path = self.local(key, etag)
+        with self.lock:
+            self.pinned.add(path)
+            if os.path.exists(path):
+                os.utime(path)
+                self.hits += 1
+                self.saved += size
+                return path
+            self.misses += 1
+            self.evict(size)
+        part = path+'.'+str(threading.get_ident())+'.part'
+        s3.download_file(ARCHIVE, key, part)
+        os.replace(part, path)
+        with self.lock:
+            self.downloaded += size
+        return path
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total > 0 else None,
+            'bytes_saved': self.saved,
+            'bytes_downloaded': self.downloaded
+        }
+
+CACHE = SnapshotCache('/tmp/snapshots', CACHE_BYTES)
+
+UPDATED = {}
+
+def asn(record):
+
+    return {
+        'id': record.get('autonomous_system_number'),
+        'org': record.get('autonomous_system_organization')
+    }
+
+def city(record):
+
+    country = record.get('country', {})
+    subdivisions = record.get('subdivisions') or [{}]
+    location = record.get('location', {})
+
+    return {
+        'country': country.get('names', {}).get('en'),
+        'c_iso': country.get('iso_code'),
+        'state': subdivisions[-1].get('names', {}).get('en'),
+        's_iso': subdivisions[-1].get('iso_code'),
+        'city': record.get('city', {}).get('names', {}).get('en'),
+        'zip': record.get('postal', {}).get('code'),
+        'latitude': location.get('latitude'),
+        'longitude': location.get('longitude')
+    }
+
+FIELDS = {
+    'asn': asn,
+    'city': city
+}
+
+EDITIONS = {
+    'GeoLite2-ASN.mmdb': ('asn', 'asn', 'net'),
+    'GeoLite2-City.mmdb': ('city', 'geo', 'cidr')
+}
+
+def query(reader, name, ipaddr):
+
+    try:
+        record, prefixlen = reader.get_with_prefix_len(ipaddr)
+    except ValueError:
+        record = None
+
+    if record is None:
+        return dict(EMPTY[name]), None
+
+    return FIELDS[name](record), ipaddress.ip_network((ipaddr, prefixlen), strict = False)
+
+def snapshot(s3, name, ipaddrs, key, etag, size):
+
+    try:
+        if BACKEND == 'range':
+            reader = remote.open_database(s3, ARCHIVE, key, etag, size)
+            return [query(reader, name, ipaddr) for ipaddr in ipaddrs]
+        with maxminddb.open_database(CACHE.get(s3, key, etag, size)) as reader:
+            return [query(reader, name, ipaddr) for ipaddr in ipaddrs]
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return [(dict(EMPTY[name]), None) for ipaddr in ipaddrs]
+        print('Snapshot Failed: '+key+' '+str(e))
+        raise
+    except Exception as e:
+        print('Snapshot Failed: '+key+' '+str(e))
+        raise
+
+def parameters(event):
+
+    ip = None
+    params = {}
+
+    for part in (event.get('rawQueryString') or '').split('&'):
+        if part == '':
+            continue
+        if '=' in part:
+            key, value = part.split('=', 1)
+            params[urllib.parse.unquote_plus(key)] = urllib.parse.unquote_plus(value)
+        elif ip is None:
+            ip = urllib.parse.unquote(part)
+
+    return params.get('ip', ip), params
+
+def utcnow():
+
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo = None)
+
+def moment(value, end = False):
+
+    match = RELATIVE.fullmatch(value)
+    if match is not None:
+        hours = int(match.group(1)) * (24 if match.group(2) == 'd' else 1)
+        return utcnow() - datetime.timedelta(hours = hours)
+
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+    if end and len(value) == 10:
+        parsed += datetime.timedelta(hours = 23)
+
+    return parsed
+
+def window(params):
+
+    since = None
+    until = None
+
+    now = utcnow()
+    oldest = (now - datetime.timedelta(days = RETENTION)).replace(minute = 0, second = 0, microsecond = 0)
+
+    if params.get('since'):
+        since = max(moment(params['since']), oldest).strftime(HOUR)
+    if params.get('until'):
+        until = min(max(moment(params['until'], True), oldest - datetime.timedelta(hours = 1)), now).strftime(HOUR)
+
+    granularity = params.get('granularity', 'hourly')
+    if granularity not in GRANULARITIES:
+        raise ValueError(granularity)
+
+    return since, until, granularity
+
+def inside(prefix, since, until):
+
+    return (since is None or prefix >= since) and (until is None or prefix <= until)
+
+def select(prefixes, granularity):
+
+    latest = {}
+    for prefix in sorted(prefixes):
+        latest[prefix[:GRANULARITIES[granularity]]] = prefix
+
+    return set(latest.values())
+
+def common(s3, prefix):
+
+    found = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket = ARCHIVE, Prefix = prefix, Delimiter = '/'):
+        found.extend([item['Prefix'] for item in page.get('CommonPrefixes', [])])
+
+    return found
+
+def scopes(s3, since, until):
+
+    if since is None:
+        months = []
+        for year in common(s3, ''):
+            if year.rstrip('/').isdigit():
+                months.extend(common(s3, year))
+        return months
+
+    start = datetime.datetime.strptime(since, HOUR)
+    end = datetime.datetime.strptime(until, HOUR) if until is not None else utcnow()
+
+    if end < start:
+        return []
+
+    if end - start <= datetime.timedelta(hours = HOURLY):
+        step = datetime.timedelta(hours = 1)
+        fmt = HOUR+'/'
+    else:
+        start = start.replace(hour = 0)
+        step = datetime.timedelta(days = 1)
+        fmt = '%Y/%m/%d/'
+
+    found = []
+    while start <= end:
+        found.append(start.strftime(fmt))
+        start += step
+
+    return found
+
+def pages(s3, prefix):
+
+    items = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket = ARCHIVE, Prefix = prefix):
+        items.extend(page.get('Contents', []))
+
+    return items
+
+def listing(s3, prefixes):
+
+    if len(prefixes) == 0:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(LISTERS, len(prefixes))) as executor:
+        results = list(executor.map(lambda prefix: pages(s3, prefix), prefixes))
+
+    return sorted([item for items in results for item in items], key = lambda item: item['Key'])
+
+def snapshots(objects, since, until, granularity):
+
+    found = {}
+    for item in objects:
+        parts = item['Key'].split('/')
+        if len(parts) != 5:
+            continue
+        prefix = '/'.join(parts[:4])
+        if inside(prefix, since, until):
+            found.setdefault(parts[4], []).append(prefix)
+
+    return {fname: select(prefixes, granularity) for fname, prefixes in found.items()}
+
+def updated(s3, key, etag):
+
+    value = UPDATED.get((key, etag))
+    if value is None:
+        response = s3.get_object(
+            Bucket = ARCHIVE,
+            Key = key
+        )
+        value = response['Body'].read().decode('utf-8')
+        UPDATED[(key, etag)] = value
+
+    return value
+
+def evaluate(s3, name, field, ipaddrs, key, etags):
+
+    s3path = '/'.join(key['Key'].split('/')[:-1])
+    release = updated(s3, s3path+'/'+name+'.updated', etags[s3path+'/'+name+'.updated'][0])
+
+    results = []
+    for tmp, net in snapshot(s3, name, ipaddrs, key['Key'], key['ETag'], key['Size']):
+        tmp[field] = str(net)
+        tmp['updated'] = release
+        results.append(tmp)
+
+    return results
+
+def shard(ipaddr, bits = BITS):
+
+    bits = bits[0] if ipaddr.version == 4 else bits[1]
+
+    return 'v'+str(ipaddr.version)+'/'+format(int(ipaddr) >> (ipaddr.max_prefixlen - bits), 'x')
+
+def load(s3, key):
+
+    try:
+        response = s3.get_object(
+            Bucket = ARCHIVE,
+            Key = key
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+    body = response['Body'].read()
+    if key.endswith('.gz'):
+        body = gzip.decompress(body)
+
+    return json.loads(body)
+
+def alias(ipaddr):
+
+    if ipaddr.version == 6:
+        for network, offset in ALIASES:
+            if ipaddr in ipaddress.ip_network(network):
+                return [network, offset]
+
+    return None
+
+def embedded(ipaddr, found):
+
+    if found is None:
+        return ipaddr
+
+    return ipaddress.IPv4Address((int(ipaddr) >> (96 - found[1])) & 0xFFFFFFFF)
+
+def widen(net, found):
+
+    if found is None or net is None:
+        return net
+
+    network = ipaddress.ip_network(net)
+    base = int(ipaddress.ip_network(found[0]).network_address)
+
+    return ipaddress.IPv6Network((base | (int(network.network_address) << (96 - found[1])), found[1] + network.prefixlen))
+
+def fetched(s3, key, loaded):
+
+    if key not in loaded:
+        loaded[key] = load(s3, key)
+
+    return loaded[key]
+
+def prefetch(s3, ipaddrs):
+
+    keys = set()
+    for ipaddr in ipaddrs:
+        for name in FIELDS:
+            keys.add('timeline/'+name+'/'+shard(embedded(ipaddr, alias(ipaddr)))+'.json.gz')
+            keys.add('timeline/'+name+'/index.json')
+
+    if len(keys) <= 1:
+        return {}
+
+    keys = sorted(keys)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(LISTERS, len(keys))) as executor:
+        return dict(zip(keys, executor.map(lambda key: load(s3, key), keys)))
+
+def indexed(s3, name, ipaddr, field, since = None, until = None, granularity = 'hourly', loaded = None):
+
+    if loaded is None:
+        loaded = {}
+
+    manifest = fetched(s3, 'timeline/'+name+'/index.json', loaded)
+    if manifest is None or manifest.get('pending') != []:
+        return None
+
+    found = alias(ipaddr)
+    if found is not None and found not in manifest.get('aliases', []):
+        return None
+
+    target = embedded(ipaddr, found)
+
+    timeline = fetched(s3, 'timeline/'+name+'/'+shard(target, manifest.get('bits', [8, 16]))+'.json.gz', loaded)
+
+    if timeline is None:
+        timeline = {
+            'releases': manifest['releases'],
+            'records': [],
+            'networks': []
+        }
+
+    value = int(target)
+    networks = timeline['networks']
+    matches = []
+    for start in sorted(set(value >> shift << shift for shift in range(target.max_prefixlen + 1))):
+        position = bisect.bisect_left(networks, start, key = lambda entry: entry[1])
+        while position < len(networks) and networks[position][1] == start:
+            if networks[position][2] >= value:
+                matches.append(networks[position])
+            position += 1
+
+    kept = select([release['prefix'] for release in timeline['releases'] if inside(release['prefix'], since, until)], granularity)
+
+    results = []
+
+    for release in timeline['releases']:
+        if release['prefix'] not in kept:
+            continue
+        record = EMPTY[name]
+        net = None
+        for network, start, end, intervals in matches:
+            for rid, first, last in intervals:
+                if first <= release['prefix'] <= last:
+                    record = timeline['records'][rid]
+                    net = network
+        tmp = dict(record)
+        tmp[field] = str(widen(net, found))
+        tmp['updated'] = release['updated']
+        results.append(tmp)
+
+    return results
+
+def histories(s3, ipaddrs, since, until, granularity):
+
+    results = [{'geo': [], 'asn': []} for ipaddr in ipaddrs]
+    pending = {'asn': [], 'city': []}
+    loaded = prefetch(s3, ipaddrs)
+
+    for position, ipaddr in enumerate(ipaddrs):
+        for name, section, field in EDITIONS.values():
+            timeline = indexed(s3, name, ipaddr, field, since, until, granularity, loaded)
+            if timeline is None:
+                pending[name].append(position)
+            else:
+                results[position][section] = timeline
+
+    if len(pending['asn']) == 0 and len(pending['city']) == 0:
+        return results
+
+    objects = listing(s3, scopes(s3, since, until))
+    kept = snapshots(objects, since, until, granularity)
+
+    etags = {}
+    for key in objects:
+        etags[key['Key']] = (key['ETag'], key['Size'])
+
+    tasks = []
+
+    for key in objects:
+
+        parts = key['Key'].split('/')
+        if len(parts) != 5 or parts[4] not in EDITIONS:
+            continue
+
+        if '/'.join(parts[:4]) not in kept.get(parts[4], ()):
+            continue
+
+        name, section, field = EDITIONS[parts[4]]
+        if len(pending[name]) > 0:
+            tasks.append((name, section, field, key))
+
+    if len(tasks) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = min(WORKERS, len(tasks))) as executor:
+            futures = [executor.submit(evaluate, s3, name, field, [ipaddrs[position] for position in pending[name]], key, etags) for name, section, field, key in tasks]
+            for (name, section, field, key), future in zip(tasks, futures):
+                for position, tmp in zip(pending[name], future.result()):
+                    results[position][section].append(tmp)
+
+    print({'cache': CACHE.stats(), 'remote': remote.stats()})
+
+    return results
+
+def addresses(event):
+
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    body = body.strip()
+
+    if body.startswith('['):
+        items = json.loads(body)
+    else:
+        items = body.splitlines()
+
+    return [str(item).strip() for item in items if str(item).strip() != '']
+
+def batch(event, since, until, granularity):
+
+    try:
+        items = addresses(event)
+    except (ValueError, UnicodeDecodeError):
+        return 400, 'Invalid Batch Body'
+
+    if len(items) > BATCH_LIMIT:
+        return 413, 'Batch Limit '+str(BATCH_LIMIT)+' Addresses'
+
+    unique = {}
+    parsed = []
+
+    for item in items:
+        try:
+            ipaddr = ipaddress.ip_address(item)
+        except ValueError:
+            parsed.append((item, None))
+            continue
+        unique[ipaddr] = None
+        parsed.append((item, ipaddr))
+
+    s3 = boto3.client('s3')
+
+    for ipaddr, history in zip(list(unique), histories(s3, list(unique), since, until, granularity)):
+        unique[ipaddr] = history
+
+    results = []
+    for item, ipaddr in parsed:
+        if ipaddr is None:
+            results.append({'ip': item, 'error': 'Invalid IP Address'})
+        else:
+            results.append({'ip': item, 'geo': unique[ipaddr]['geo'], 'asn': unique[ipaddr]['asn']})
+
+    return 200, {
+        'count': len(results),
+        'unique': len(unique),
+        'results': results,
+        'attribution': DESC
+    }
 
 def handler(event, context):
 
     print(event)
 
-    ip = event['rawQueryString']
+    CACHE.reset()
+
+    ip, params = parameters(event)
 
     try:
+        since, until, granularity = window(params)
+    except (ValueError, OverflowError):
+        return {
+            'statusCode': 400,
+            'body': json.dumps('Invalid Window')
+        }
+
+    if event.get('requestContext', {}).get('http', {}).get('method') == 'POST':
+
+        code, data = batch(event, since, until, granularity)
+
+        return {
+            'statusCode': code,
+            'body': json.dumps(data, separators = (',', ':'))
+        }
 
+    try:
         ipaddr = ipaddress.ip_address(ip)
+    except ValueError:
+        return {
+            'statusCode': 404,
+            'body': json.dumps('Invalid IP Address', indent = 4)
+        }
+
+    try:
+
         code = 200
 
         data = {}
         data['ip'] = ip
         data['geo'] = []
         data['asn'] = []
-        data['attribution'] = 'This product includes GeoLite2 data created by MaxMind, available from https://www.maxmind.com.'
+        data['attribution'] = DESC
 
         s3 = boto3.client('s3')
 
-        objects = s3.list_objects(
-            Bucket = 'maxmindgeolite2archive',
-        )
+        history = histories(s3, [ipaddr], since, until, granularity)[0]
+        data['geo'] = history['geo']
+        data['asn'] = history['asn']
 
-        for key in objects['Contents']:
-
-            fname = key['Key'].split('/')[4]
-
-            if fname == 'GeoLite2-ASN.mmdb':
-
-                s3path = '/'.join(key['Key'].split('/')[:-1])
-                s3.download_file('maxmindgeolite2archive', s3path+'/asn.updated', '/tmp/asn.updated')
-                s3.download_file('maxmindgeolite2archive', key['Key'], '/tmp/'+fname)
-
-                f = open('/tmp/asn.updated', 'r')
-                updated = f.read()
-                f.close()
-
-                try:
-                    with geoip2.database.Reader('/tmp/GeoLite2-ASN.mmdb') as reader2:
-                        response2 = reader2.asn(ip)
-                        asn = response2.autonomous_system_number
-                        org = response2.autonomous_system_organization
-                        net = response2.network
-                except:
-                    asn = None
-                    org = None
-                    net = None
-
-                tmp = {
-                    'id': asn,
-                    'org': org,
-                    'net': str(net),
-                    'updated': updated
-                }
-
-                data['asn'].append(tmp)
-
-            elif fname == 'GeoLite2-City.mmdb':
-
-                s3path = '/'.join(key['Key'].split('/')[:-1])
-                s3.download_file('maxmindgeolite2archive', s3path+'/city.updated', '/tmp/city.updated')
-                s3.download_file('maxmindgeolite2archive', key['Key'], '/tmp/'+fname)
-
-                f = open('/tmp/city.updated', 'r')
-                updated = f.read()
-                f.close()
-
-                try:
-                    with geoip2.database.Reader('/tmp/GeoLite2-City.mmdb') as reader:
-                        response = reader.city(ip)
-                        country_code = response.country.iso_code
-                        country_name = response.country.name
-                        state_code = response.subdivisions.most_specific.iso_code
-                        state_name = response.subdivisions.most_specific.name
-                        city_name = response.city.name
-                        zip_code = response.postal.code
-                        latitude = response.location.latitude
-                        longitude = response.location.longitude
-                        cidr = response.traits.network
-                except:
-                    country_code = None
-                    country_name = None
-                    state_code = None
-                    state_name = None
-                    city_name = None
-                    zip_code = None
-                    latitude = None
-                    longitude = None
-                    cidr = None
-
-                tmp = {
-                    'country':country_name,
-                    'c_iso':country_code,
-                    'state':state_name,
-                    's_iso':state_code,
-                    'city':city_name,
-                    'zip':zip_code,
-                    'latitude':latitude,
-                    'longitude':longitude,
-                    'cidr':str(cidr),
-                    'updated': updated
-                }
-
-                data['geo'].append(tmp)
-
-    except:
-        code = 404
-        data = 'Invalid IP Address'
+    except Exception:
+        code = 500
+        data = 'History Unavailable'
         pass
 
     return {
         'statusCode': code,
         'body': json.dumps(data, indent = 4)
-    }
\ No newline at end of file
+    }
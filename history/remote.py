@@ -0,0 +1,185 @@
+import collections
+import maxminddb
+import maxminddb.decoder
+import os
+import threading
+
+BLOCK = int(os.environ.get('RANGE_BLOCK', '16384'))
+
+READAHEAD = int(os.environ.get('RANGE_READAHEAD', '1'))
+
+BLOCKS = int(os.environ.get('RANGE_BLOCKS', '256'))
+
+READERS = int(os.environ.get('RANGE_READERS', '64'))
+
+METADATA_START_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+class RangeBuffer:
+
+    def __init__(self, s3, bucket, key, length):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.length = length
+        self.name = 's3://'+bucket+'/'+key
+        self.lock = threading.Lock()
+        self.blocks = collections.OrderedDict()
+        self.requests = 0
+        self.transferred = 0
+
+    def fetch(self, first, last):
+        start = first * BLOCK
+        end = min(self.length, (last + 1) * BLOCK) - 1
+        response = self.s3.get_object(
+            Bucket = self.bucket,
+            Key = self.key,
+            Range = 'bytes='+str(start)+'-'+str(end)
+        )
+        data = response['Body'].read()
+        with self.lock:
+            self.requests += 1
+            self.transferred += len(data)
+            for block in range(first, last + 1):
+                self.blocks[block] = data[(block - first) * BLOCK:(block - first + 1) * BLOCK]
+                self.blocks.move_to_end(block)
+            while len(self.blocks) > max(BLOCKS, last - first + 1):
+                self.blocks.popitem(last = False)
+
+    def read(self, offset, size):
+        end = min(self.length, offset + size)
+        if end <= offset:
+            return b''
+        first = offset // BLOCK
+        last = (end - 1) // BLOCK
+        missing = [block for block in range(first, last + 1) if block not in self.blocks]
+        if len(missing) > 0:
+            self.fetch(missing[0], min(missing[-1] + READAHEAD, (self.length - 1) // BLOCK))
+        with self.lock:
+            chunks = []
+            for block in range(first, last + 1):
+                chunk = self.blocks.get(block)
+                if chunk is None:
+                    break
+                self.blocks.move_to_end(block)
+                chunks.append(chunk)
+        if len(chunks) != last - first + 1:
+            self.fetch(first, last)
+            return self.read(offset, size)
+        data = b''.join(chunks)
+        return data[offset - first * BLOCK:end - first * BLOCK]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.read(index.start, index.stop - index.start)
+        return self.read(index, 1)[0]
+
+    def rfind(self, needle, start):
+        position = self.read(start, self.length - start).rfind(needle)
+        if position == -1:
+            return position
+        return start + position
+
+    def size(self):
+        return self.length
+
+    def close(self):
+        with self.lock:
+            self.blocks.clear()
+
+class RemoteReader:
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+        start = buffer.rfind(METADATA_START_MARKER, max(0, buffer.size() - 128 * 1024))
+        if start == -1:
+            raise maxminddb.InvalidDatabaseError('Error opening database file ('+buffer.name+'). Is this a valid MaxMind DB file?')
+        start += len(METADATA_START_MARKER)
+
+        metadata, _ = maxminddb.decoder.Decoder(buffer, start).decode(start)
+        self.node_count = metadata['node_count']
+        self.record_size = metadata['record_size']
+        self.ip_version = metadata['ip_version']
+        self.search_tree_size = self.node_count * self.record_size // 4
+        self.decoder = maxminddb.decoder.Decoder(buffer, self.search_tree_size + 16)
+
+        node = 0
+        if self.ip_version == 6:
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self.read_node(node, 0)
+        self.ipv4_start = node
+
+    def read_node(self, node, index):
+        if self.record_size == 24:
+            offset = node * 6 + index * 3
+            return int.from_bytes(self.buffer[offset:offset + 3], 'big')
+        if self.record_size == 28:
+            offset = node * 7
+            if index:
+                return int.from_bytes(self.buffer[offset + 3:offset + 7], 'big') & 0x0FFFFFFF
+            record = int.from_bytes(self.buffer[offset:offset + 4], 'big')
+            return (record >> 8) | ((record & 0xF0) << 20)
+        if self.record_size == 32:
+            offset = node * 8 + index * 4
+            return int.from_bytes(self.buffer[offset:offset + 4], 'big')
+        raise maxminddb.InvalidDatabaseError('Unknown record size: '+str(self.record_size))
+
+    def get_with_prefix_len(self, ipaddr):
+        if ipaddr.version == 6 and self.ip_version == 4:
+            raise ValueError('Error looking up '+str(ipaddr)+'. You attempted to look up an IPv6 address in an IPv4-only database.')
+
+        packed = ipaddr.packed
+        bits = len(packed) * 8
+        node = self.ipv4_start if bits == 32 and self.ip_version == 6 else 0
+
+        depth = 0
+        while depth < bits and node < self.node_count:
+            bit = 1 & (packed[depth >> 3] >> 7 - (depth % 8))
+            node = self.read_node(node, bit)
+            depth += 1
+
+        if node == self.node_count:
+            return None, depth
+        if node > self.node_count:
+            record, _ = self.decoder.decode(node - self.node_count + self.search_tree_size)
+            return record, depth
+
+        raise maxminddb.InvalidDatabaseError('Invalid node in search tree')
+
+    def close(self):
+        self.buffer.close()
+
+OPENED = collections.OrderedDict()
+
+LOCK = threading.Lock()
+
+def open_database(s3, bucket, key, etag, size):
+
+    with LOCK:
+        reader = OPENED.get((key, etag))
+        if reader is not None:
+            OPENED.move_to_end((key, etag))
+            return reader
+
+    reader = RemoteReader(RangeBuffer(s3, bucket, key, size))
+
+    with LOCK:
+        OPENED[(key, etag)] = reader
+        while len(OPENED) > READERS:
+            _, evicted = OPENED.popitem(last = False)
+            evicted.close()
+
+    return reader
+
+def stats():
+
+    with LOCK:
+        readers = list(OPENED.values())
+
+    return {
+        'readers': len(readers),
+        'requests': sum(reader.buffer.requests for reader in readers),
+        'bytes_transferred': sum(reader.buffer.transferred for reader in readers)
+    }
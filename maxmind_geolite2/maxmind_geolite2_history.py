@@ -22,16 +22,6 @@ class MaxmindGeolite2History(Stack):
 
     ### LAMBDA LAYERS ###
 
-        pkggeoip2 = _ssm.StringParameter.from_string_parameter_arn(
-            self, 'pkggeoip2',
-            'arn:aws:ssm:us-east-1:070176467818:parameter/pkg/geoip2'
-        )
-
-        geoip2 = _lambda.LayerVersion.from_layer_version_arn(
-            self, 'geoip2',
-            layer_version_arn = pkggeoip2.string_value
-        )
-
         pkgmaxminddb = _ssm.StringParameter.from_string_parameter_arn(
             self, 'pkgmaxminddb',
             'arn:aws:ssm:us-east-1:070176467818:parameter/pkg/maxminddb'
@@ -88,11 +78,13 @@ class MaxmindGeolite2History(Stack):
             architecture = _lambda.Architecture.ARM_64,
             code = _lambda.Code.from_asset('history'),
             handler = 'history.handler',
+            environment = dict(
+                SNAPSHOT_BACKEND = 'range'
+            ),
             timeout = Duration.seconds(30),
             memory_size = 1024,
             role = role,
             layers = [
-                geoip2,
                 maxminddb
             ]
         )
@@ -167,7 +159,8 @@ class MaxmindGeolite2History(Stack):
         api.add_routes(
             path = '/',
             methods = [
-                _api.HttpMethod.GET
+                _api.HttpMethod.GET,
+                _api.HttpMethod.POST
             ],
             integration = integration
         )
@@ -15,6 +15,7 @@ from aws_cdk import (
     aws_route53_targets as _r53targets,
     aws_s3 as _s3,
     aws_s3_deployment as _deployment,
+    aws_s3_notifications as _notifications,
     aws_ssm as _ssm
 )
 
@@ -47,6 +48,16 @@ class MaxmindGeolite2Stack(Stack):
             layer_version_arn = pkgmaxminddb.string_value
         )
 
+        pkgnumpy = _ssm.StringParameter.from_string_parameter_arn(
+            self, 'pkgnumpy',
+            'arn:aws:ssm:us-east-1:070176467818:parameter/pkg/numpy'
+        )
+
+        numpy = _lambda.LayerVersion.from_layer_version_arn(
+            self, 'numpy',
+            layer_version_arn = pkgnumpy.string_value
+        )
+
         organization = _ssm.StringParameter.from_string_parameter_arn(
             self, 'organization',
             'arn:aws:ssm:us-east-1:070176467818:parameter/root/organization'
@@ -179,6 +190,22 @@ class MaxmindGeolite2Stack(Stack):
             tier = _ssm.ParameterTier.STANDARD
         )
 
+        asnetagparameter = _ssm.StringParameter(
+            self, 'asnetagparameter',
+            parameter_name = '/maxmind/geolite2/asnetag',
+            string_value = 'EMPTY',
+            description = 'MaxMind GeoLite2 ASN ETag',
+            tier = _ssm.ParameterTier.STANDARD
+        )
+
+        cityetagparameter = _ssm.StringParameter(
+            self, 'cityetagparameter',
+            parameter_name = '/maxmind/geolite2/cityetag',
+            string_value = 'EMPTY',
+            description = 'MaxMind GeoLite2 City ETag',
+            tier = _ssm.ParameterTier.STANDARD
+        )
+
     ### SEARCH ###
 
         role = _iam.Role(
@@ -211,12 +238,20 @@ class MaxmindGeolite2Stack(Stack):
             architecture = _lambda.Architecture.ARM_64,
             code = _lambda.Code.from_asset('search'),
             handler = 'search.handler',
+            environment = dict(
+                CACHE_SIZE = '10000',
+                LOG_EVENTS = '0.01',
+                METRICS_NAMESPACE = 'GeoLite2/Search',
+                MMDB_MODE = 'mmap',
+                MMDB_PATH = '/opt'
+            ),
             timeout = Duration.seconds(7),
             memory_size = 128,
             role = role,
             layers = [
                 geoip2,
-                maxminddb
+                maxminddb,
+                numpy
             ]
         )
 
@@ -245,10 +280,18 @@ class MaxmindGeolite2Stack(Stack):
         build.add_to_policy(
             _iam.PolicyStatement(
                 actions = [
+                    'lambda:DeleteLayerVersion',
+                    'lambda:GetFunctionConfiguration',
+                    'lambda:ListLayerVersions',
+                    'lambda:PublishLayerVersion',
                     'lambda:UpdateFunctionCode',
+                    'lambda:UpdateFunctionConfiguration',
+                    's3:DeleteObject',
                     's3:GetObject',
+                    's3:ListBucket',
                     's3:PutObject',
                     'ssm:GetParameter',
+                    'ssm:GetParameters',
                     'ssm:PutParameter'
                 ],
                 resources = [
@@ -270,14 +313,18 @@ class MaxmindGeolite2Stack(Stack):
                 SSM_PARAMETER_ACCT = '/maxmind/geolite2/account',
                 SSM_PARAMETER_KEY = '/maxmind/geolite2/api',
                 SSM_PARAMETER_ASN = '/maxmind/geolite2/asn',
+                SSM_PARAMETER_ASN_ETAG = '/maxmind/geolite2/asnetag',
                 SSM_PARAMETER_CITY = '/maxmind/geolite2/city',
-                LAMBDA_FUNCTION = search.function_name
+                SSM_PARAMETER_CITY_ETAG = '/maxmind/geolite2/cityetag',
+                LAMBDA_FUNCTION = search.function_name,
+                LAMBDA_LAYER = 'geolite2'
             ),
             ephemeral_storage_size = Size.gibibytes(1),
             timeout = Duration.seconds(900),
             memory_size = 1024,
             role = build,
             layers = [
+                maxminddb,
                 requests
             ]
         )
@@ -289,6 +336,41 @@ class MaxmindGeolite2Stack(Stack):
             removal_policy = RemovalPolicy.DESTROY
         )
 
+        timeline = _lambda.Function(
+            self, 'timeline',
+            runtime = _lambda.Runtime.PYTHON_3_13,
+            architecture = _lambda.Architecture.ARM_64,
+            code = _lambda.Code.from_asset('download'),
+            handler = 'timeline.handler',
+            environment = dict(
+                S3_ARCHIVE = archive.bucket_name,
+                TIMELINE_BACKFILL = '2'
+            ),
+            ephemeral_storage_size = Size.gibibytes(1),
+            timeout = Duration.seconds(900),
+            memory_size = 2048,
+            reserved_concurrent_executions = 1,
+            role = build,
+            layers = [
+                maxminddb
+            ]
+        )
+
+        timelinelogs = _logs.LogGroup(
+            self, 'timelinelogs',
+            log_group_name = '/aws/lambda/'+timeline.function_name,
+            retention = _logs.RetentionDays.ONE_WEEK,
+            removal_policy = RemovalPolicy.DESTROY
+        )
+
+        archive.add_event_notification(
+            _s3.EventType.OBJECT_CREATED,
+            _notifications.LambdaDestination(timeline),
+            _s3.NotificationKeyFilter(
+                suffix = '.mmdb'
+            )
+        )
+
         event = _events.Rule(
             self, 'event',
             schedule = _events.Schedule.cron(
@@ -306,6 +388,12 @@ class MaxmindGeolite2Stack(Stack):
             )
         )
 
+        event.add_target(
+            _targets.LambdaFunction(
+                timeline
+            )
+        )
+
     ### HOSTZONE ###
 
         hostzoneid = _ssm.StringParameter.from_string_parameter_attributes(
@@ -368,6 +456,15 @@ class MaxmindGeolite2Stack(Stack):
 
         api.add_routes(
             path = '/',
+            methods = [
+                _api.HttpMethod.GET,
+                _api.HttpMethod.POST
+            ],
+            integration = integration
+        )
+
+        api.add_routes(
+            path = '/reverse',
             methods = [
                 _api.HttpMethod.GET
             ],